@@ -1,53 +1,183 @@
-from flask import Flask, jsonify, request
-import yfinance as yf
-from tinydb import TinyDB, Query
-from flask_bcrypt import Bcrypt
+from flask import Flask, g, jsonify, request
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from database import stock_transactions, portfolio_table, users_table, history_asset_table
+from database import db
+import repository
+import trade_engine
+import ledger
+import valuation
+import asset_series
+from pagination import decode_cursor, paginate
+from migrate_tinydb import migrate
 from flask_cors import CORS
-from datetime import datetime, timezone
-import pandas as pd
+from datetime import date, datetime, timedelta
+import csv
+import hmac
+import io
+import json
+import logging
+import time
 import math
-from cachetools import TTLCache
+import os
 from models import StockTransaction, Portfolio, HistoryAsset, User, find_user_by_username
+from market_data import create_provider
+from quote_cache import QuoteCache, CachedMarketDataProvider
+from fetch_pipeline import FetchPipeline, CircuitBreaker
+from price_refresher import PriceRefresher
+from price_history import PriceHistoryStore
+from sector_pages import SectorPages
+from quote_stream import QuoteStream
+from user_cache import user_cache
+from password_hasher import PasswordHasher, HasherBusy
+from metrics import metrics
+from snapshot_job import SnapshotScheduler
 
 app = Flask(__name__)
 app.config['JWT_SECRET_KEY'] = 'super-secret-key' 
 
 CORS(app, supports_credentials=True)
 
-bcrypt = Bcrypt(app)
-jwt = JWTManager(app)
-
-# Create a cache with a TTL of 5 minutes and a maximum size of 100 items
-stock_cache = TTLCache(maxsize=100, ttl=300)
+# One structured (JSON) log line per request
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), format='%(message)s')
+request_log = logging.getLogger('stocks.requests')
 
-def get_cached_stock_list(tickers):
-    result = []
-    query_list = []
-    for ticker in tickers:
-        if ticker in stock_cache:
-            result.append(stock_cache[ticker])
-        else:
-            query_list.append(ticker)
-    
-    query_res = yf.Tickers(' '.join(query_list))
-            
-    for ticker in query_res.tickers:
-        # Get stock information
-        stock = query_res.tickers[ticker]
-        stock_cache[ticker] = stock
-        result.append(stock)
-    
-    return result
-    
+jwt = JWTManager(app)
 
-def get_cached_stock(ticker):
-    if ticker in stock_cache:
-        return stock_cache[ticker]
-    stock = yf.Ticker(ticker)
-    stock_cache[ticker] = stock
-    return stock
+# bcrypt runs in worker processes; when too many hashes are queued, auth
+# requests are turned away instead of starving every other endpoint
+password_hasher = PasswordHasher(
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+    max_pending=int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 16)),
+    rounds=int(os.environ.get('BCRYPT_LOG_ROUNDS', 12)),
+)
+password_hasher.start()
+
+def auth_busy():
+    response = jsonify({"error": "Too many sign-in attempts, please retry shortly"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# Create the SQLite schema and apply any write-ahead log left by a crash;
+# on first start import the legacy TinyDB file
+db.init_schema()
+db.recover()
+if os.path.exists('stocks.json') and not db.query_one('SELECT 1 AS found FROM users LIMIT 1'):
+    migrate('stocks.json', db)
+# Build the position ledger for databases that predate it. Checking an
+# existing ledger replays every transaction, so that is left to
+# `python rebuild_ledger.py --verify-only`
+if not db.query_one('SELECT 1 AS found FROM ledger_positions LIMIT 1'):
+    try:
+        ledger.rebuild()
+    except ledger.LedgerError as e:
+        logging.getLogger('stocks.ledger').error("Could not build the position ledger: %s", e)
+# Likewise for the columnar asset history series
+if not db.query_one('SELECT 1 AS found FROM asset_series LIMIT 1'):
+    asset_series.rebuild()
+
+# Cache of resolved market data values: prices expire after seconds,
+# company metadata after hours
+quote_cache = QuoteCache(
+    ttls={
+        'quote': int(os.environ.get('QUOTE_TTL_SECONDS', 15)),
+        'history': int(os.environ.get('HISTORY_TTL_SECONDS', 3600)),
+        'info': int(os.environ.get('INFO_TTL_SECONDS', 6 * 3600)),
+        'sector': int(os.environ.get('SECTOR_TTL_SECONDS', 24 * 3600)),
+        'unknown': int(os.environ.get('UNKNOWN_SYMBOL_TTL_SECONDS', 3600)),
+    },
+    max_bytes=int(os.environ.get('QUOTE_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    max_stale=int(os.environ.get('QUOTE_MAX_STALE_SECONDS', 300)),
+)
+
+# Market data source: 'yfinance' (default) or 'fake' for offline runs
+provider = create_provider(os.environ.get('MARKET_DATA_PROVIDER', 'yfinance'))
+
+# Daily bars kept on local disk; sparkline history is read from here and
+# bars are refetched only from the last stored day on
+price_history = PriceHistoryStore(
+    provider,
+    os.environ.get('PRICE_HISTORY_DIR', 'price_history'),
+    refresh_interval=int(os.environ.get('PRICE_HISTORY_REFRESH_SECONDS', 3600)),
+)
+
+# Upstream calls run concurrently with timeouts, retries and a circuit
+# breaker; while upstream is down, cached values are served
+fetch_pipeline = FetchPipeline(
+    max_workers=int(os.environ.get('UPSTREAM_CONCURRENCY', 8)),
+    timeout=float(os.environ.get('UPSTREAM_TIMEOUT_SECONDS', 5)),
+    retries=int(os.environ.get('UPSTREAM_RETRIES', 2)),
+    backoff=float(os.environ.get('UPSTREAM_BACKOFF_SECONDS', 0.2)),
+    queue_timeout=float(os.environ.get('UPSTREAM_QUEUE_TIMEOUT_SECONDS', 5)),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get('UPSTREAM_BREAKER_FAILURES', 5)),
+        reset_timeout=float(os.environ.get('UPSTREAM_BREAKER_RESET_SECONDS', 30)),
+    ),
+)
+
+market_data = CachedMarketDataProvider(provider, quote_cache, price_history, fetch_pipeline)
+
+# Every ticker held in a portfolio or watched by any user
+def get_tracked_tickers():
+    # Held, watched, shown on a cached sector page or streamed to a client
+    return set(repository.get_held_tickers()) | set(repository.get_watched_tickers()) \
+        | set(sector_pages.tickers()) | set(quote_stream.tickers())
+
+# Refreshes tracked tickers in the background; interval 0 disables it
+price_refresher = PriceRefresher(
+    market_data,
+    get_tracked_tickers,
+    interval=int(os.environ.get('PRICE_REFRESH_INTERVAL', 15)),
+    batch_size=int(os.environ.get('PRICE_REFRESH_BATCH_SIZE', 100)),
+)
+
+# Daily server-side asset history snapshot at a local HH:MM time, e.g. 21:30
+snapshot_scheduler = SnapshotScheduler(market_data, os.environ['ASSET_SNAPSHOT_TIME']) \
+    if os.environ.get('ASSET_SNAPSHOT_TIME') else None
+
+# Start background jobs lazily so only the process serving requests runs them
+@app.before_request
+def start_background_jobs():
+    price_refresher.start()
+    if snapshot_scheduler:
+        snapshot_scheduler.start()
+
+# Time every request and attribute upstream and database time to it
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.begin_request()
+
+@app.after_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    # The route pattern, not the raw path, keeps label cardinality bounded
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe('http_request_duration_seconds',
+                    {'method': request.method, 'route': route, 'status': response.status_code}, seconds)
+    totals = metrics.end_request()
+    request_log.info(json.dumps({
+        'event': 'request',
+        'method': request.method,
+        'route': route,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round(seconds * 1000, 2),
+        'upstream_calls': totals['upstream_calls'],
+        'upstream_ms': round(totals['upstream_seconds'] * 1000, 2),
+        'db_queries': totals['db_queries'],
+        'db_ms': round(totals['db_seconds'] * 1000, 2),
+    }))
+    return response
+
+# Day change of a quote as (change, change percent), 'N/A' when unknown
+def get_day_change(quote):
+    previous_close = quote.get('previous_close')
+    if previous_close is None:
+        return 'N/A', 'N/A'
+    day_change = quote['price'] - previous_close
+    return day_change, (day_change / previous_close) * 100
 
 # Endpoint: User Signup
 @app.route('/signup', methods=['POST'])
@@ -64,15 +194,11 @@ def signup():
     # Hash the password and store the user
     # When users first sign up, they start with a balance of $10000
     
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
-    # users_table.insert({'username': username, 'password': hashed_password, 'balance': 10000})
-    users_table.insert(
-        {
-            'username': username, 
-            'password': hashed_password, 
-            'balance': 10000, 
-            'created_at': datetime.now(timezone.utc).isoformat()
-            })
+    try:
+        hashed_password = password_hasher.hash(password)
+    except HasherBusy:
+        return auth_busy()
+    repository.create_user(username, hashed_password, balance=10000)
     
     # Create JWT token
     access_token = create_access_token(identity=username)
@@ -86,13 +212,22 @@ def login():
     password = data['password']
 
     # Find the user in the database
+    # Unknown users are turned away without hashing anything
     user = find_user_by_username(username)
     if not user:
+        password_hasher.record_login('unknown_user')
         return jsonify({"error": "User does not exist!"}), 400
 
     # Verify the password
-    if not bcrypt.check_password_hash(user['password'], password):
+    try:
+        valid = password_hasher.check(user['password'], password)
+    except HasherBusy:
+        password_hasher.record_login('rejected')
+        return auth_busy()
+    if not valid:
+        password_hasher.record_login('invalid_password')
         return jsonify({"error": "Invalid password!"}), 400
+    password_hasher.record_login('success')
 
     # Create JWT token
     access_token = create_access_token(identity=username)
@@ -105,79 +240,197 @@ def get_transactions():
     current_user = get_jwt_identity()
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
+    cursor = request.args.get('cursor')
+    if page < 1 or not 1 <= per_page <= 100:
+        return jsonify({"error": "page >= 1 and 1 <= per_page <= 100 are required"}), 400
     user = find_user_by_username(current_user)
-    transactions = stock_transactions.search(Query().uid == user.doc_id)
-    total_num_trans = len(transactions)
-    start = (page - 1) * per_page
-    end = start + per_page
-    
-    page_trans = transactions[start:end]
-    for transaction in page_trans:
-        transaction['price'] = round(transaction['price'], 2)
-        transaction['created_at'] = transaction['created_at'].split('T')[0]
+    total_num_trans = repository.count_transactions(user['id'])
+    
+    # With a cursor, seek straight to the next page through the (uid, created_at, id)
+    # index; page/per_page keep working as offset pagination
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+            rows = repository.get_transactions_after(user['id'], after and (str(after[0]), int(after[1])), per_page + 1)
+        except (ValueError, TypeError, IndexError, KeyError):
+            return jsonify({"error": "Invalid cursor"}), 400
+    else:
+        start = (page - 1) * per_page
+        rows = repository.get_transactions_page(user['id'], start, per_page + 1)
+    page_trans, next_cursor = paginate(rows, per_page, lambda row: [row['created_at'], row['id']])
     
     result = {
         "total": total_num_trans,
         "page": page,
         "per_page": per_page,
         "total_pages": math.ceil(total_num_trans / per_page),
-        "data": page_trans
+        "next_cursor": next_cursor,
+        "data": [format_transaction(transaction) for transaction in page_trans]
     }
     
     return jsonify(result)
 
+def format_transaction(row):
+    # Copy for display: price to cents, created_at as the date only
+    return dict(row, price=round(row['price'], 2), created_at=row['created_at'].split('T')[0])
+
+EXPORT_COLUMNS = ['id', 'ticker', 'action', 'quantity', 'price', 'created_at']
+
+# Endpoint: download every transaction as CSV or NDJSON, optionally only one
+# ticker and/or a date range (start and end are inclusive YYYY-MM-DD dates).
+# Rows are streamed in batches, so memory use does not grow with history
+@app.route('/transactions/export', methods=['GET'])
+@jwt_required()
+def export_transactions():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    try:
+        start = request.args.get('start')
+        start = date.fromisoformat(start).isoformat() if start else None
+        end = request.args.get('end')
+        end = (date.fromisoformat(end) + timedelta(days=1)).isoformat() if end else None
+    except ValueError:
+        return jsonify({"error": "start and end must be YYYY-MM-DD dates"}), 400
+    ticker = request.args.get('ticker')
+
+    current_user = get_jwt_identity()
+    user = find_user_by_username(current_user)
+    rows = repository.iter_transactions(user['id'], start, end, ticker)
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow([round(row[column], 2) if column == 'price' else row[column] for column in EXPORT_COLUMNS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def generate_ndjson():
+        for row in rows:
+            record = {column: row[column] for column in EXPORT_COLUMNS}
+            record['price'] = round(record['price'], 2)
+            yield json.dumps(record) + '\n'
+
+    if export_format == 'csv':
+        response = app.response_class(generate_csv(), mimetype='text/csv')
+    else:
+        response = app.response_class(generate_ndjson(), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename=transactions.{export_format}'
+    return response
+
 # Endpoint: Get User Portfolio (Requires Authentication)
 @app.route('/portfolio', methods=['GET'])
 @jwt_required()
 def view_portfolio():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
+    cursor = request.args.get('cursor')
+    if page < 1 or not 1 <= per_page <= 100:
+        return jsonify({"error": "page >= 1 and 1 <= per_page <= 100 are required"}), 400
     current_user = get_jwt_identity()
-    print("current_user", current_user)
     user = find_user_by_username(current_user)
-    print("user", user)
-    # get all the stocks in the user's portfolio
-    portfolios = portfolio_table.search(Query().uid == user.doc_id)
-    total_num_companies = len(portfolios)
-    start = (page - 1) * per_page
-    end = start + per_page
+    # get one page of the stocks in the user's portfolio
+    total_num_companies = repository.count_positions(user['id'])
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+            rows = repository.get_positions_after(user['id'], after and int(after[0]), per_page + 1)
+        except (ValueError, TypeError, IndexError, KeyError):
+            return jsonify({"error": "Invalid cursor"}), 400
+    else:
+        start = (page - 1) * per_page
+        rows = repository.get_positions_page(user['id'], start, per_page + 1)
+    page_portfolios, next_cursor = paginate(rows, per_page, lambda row: [row['id']])
+    # One batched quote lookup for the whole page
+    quotes = market_data.get_quotes([portfolio['ticker'] for portfolio in page_portfolios])
+    stock_data = portfolio_rows(user, page_portfolios, quotes)
+
+    result = {
+        "total": total_num_companies,
+        "page": page,
+        "per_page": per_page,
+        "total_pages": math.ceil(total_num_companies / per_page),
+        "next_cursor": next_cursor,
+        "data": stock_data
+    }
     
-    page_portfolios = portfolios[start:end]
+    return jsonify(result)
+
+def portfolio_rows(user, page_portfolios, quotes):
+    # /portfolio rows for one page of positions, with ledger cost and P&L
+    infos = market_data.get_infos([portfolio['ticker'] for portfolio in page_portfolios])
+    positions = ledger.get_positions(user['id'])
+    # Value the whole page in one vectorized pass; unpriced rows are dropped
+    valued = valuation.value_positions(page_portfolios, quotes)
+    portfolio_by_ticker = {portfolio['ticker']: portfolio for portfolio in page_portfolios}
     stock_data = []
-    for portfolio in page_portfolios:
-        ticker = portfolio['ticker']
+    for row in valued.itertuples(index=False):
+        ticker = row.ticker
+        portfolio = portfolio_by_ticker[ticker]
         quantity = portfolio['total_quantity']
-        stock = get_cached_stock(ticker)
-        current_price = stock.history(period="1d")['Close'][0]
-        stock_info = stock.info
-        previous_close = stock_info.get('regularMarketPreviousClose', 'N/A')  # Previous Close Price
-        day_change = current_price - previous_close if current_price != 'N/A' and previous_close != 'N/A' else 'N/A'  # Change in a day
-        day_change_percent = (day_change / previous_close) * 100 if day_change != 'N/A' and previous_close != 'N/A' else 'N/A'
+        current_price = row.price
         created_at = portfolio.get('created_at')
         updated_at = portfolio.get('updated_at')
         timestamp = updated_at if updated_at else created_at
+        position = positions.get(ticker)
         stock_data.append({
             'ticker': ticker,
-            'company_name': stock.info.get('longName', 'N/A'),
+            'company_name': infos.get(ticker, {}).get('company_name', 'N/A'),
             'timestamp': timestamp.split('T')[0],
             'quantity': quantity,
-            'day_change': round(day_change, 2),
-            'day_change_percent': day_change_percent,
+            'day_change': valuation.na(row.day_change, 2),  # Change in a day
+            'day_change_percent': valuation.na(row.day_change_percent),
             'price': round(current_price, 2),
-            'total_value': round(current_price * quantity, 2)
+            'total_value': round(row.market_value, 2),
+            'average_cost': round(position['average_cost'], 2) if position else 'N/A',
+            'unrealized_pnl': round((current_price - position['average_cost']) * quantity, 2) if position else 'N/A',
+            'realized_pnl': round(position['realized_pnl'], 2) if position else 'N/A'
         })
-    
-    
+    return stock_data
 
-    result = {
-        "total": total_num_companies,
-        "page": page,
-        "per_page": per_page,
-        "total_pages": math.ceil(total_num_companies / per_page),
-        "data": stock_data
-    }
-    
-    return jsonify(result)
+# Endpoint: Get realized and unrealized profit and loss per position
+@app.route('/pnl', methods=['GET'])
+@jwt_required()
+def get_pnl():
+    current_user = get_jwt_identity()
+    user = find_user_by_username(current_user)
+    positions = ledger.get_positions(user['id'])
+    quotes = market_data.get_quotes([ticker for ticker, position in positions.items() if position['quantity']])
+    data = []
+    total_realized = 0
+    total_unrealized = 0
+    for ticker, position in positions.items():
+        quote = quotes.get(ticker)
+        market_value = quote['price'] * position['quantity'] if quote else None
+        unrealized = market_value - position['cost_basis'] if market_value is not None else 0
+        total_realized += position['realized_pnl']
+        total_unrealized += unrealized
+        data.append({
+            'ticker': ticker,
+            'quantity': position['quantity'],
+            'average_cost': round(position['average_cost'], 2),
+            'cost_basis': round(position['cost_basis'], 2),
+            'market_value': round(market_value, 2) if market_value is not None else 'N/A',
+            'unrealized_pnl': round(unrealized, 2),
+            'realized_pnl': round(position['realized_pnl'], 2)
+        })
+    return jsonify({
+        "cost_method": ledger.COST_METHOD,
+        "realized_pnl": round(total_realized, 2),
+        "unrealized_pnl": round(total_unrealized, 2),
+        "data": data
+    })
+
+def price_unavailable(ticker):
+    # Response for a trade without a fresh quote: the symbol is either
+    # unknown or its price could not be fetched just now
+    if market_data.is_unknown(ticker):
+        return jsonify({"message": "Unknown stock"}), 400
+    return jsonify({"message": f"No current price for {ticker}, please try again"}), 503
 
 # Endpoint: Buy Stock
 @app.route('/buy', methods=['POST'])
@@ -187,36 +440,20 @@ def buy_stock():
     ticker = data['ticker']
     quantity = data['quantity']
 
-    # Fetch current stock price
-    stock = get_cached_stock(ticker)
-    price = stock.history(period="1d")['Close'][0]
+    # Trades fill only at a fresh quote, never a stale or fallback one
+    quote = market_data.get_quote(ticker, allow_stale=False)
+    if not quote:
+        return price_unavailable(ticker)
+    price = quote['price']
     
-    # Check if the user has enough balance
+    # Check the balance, record the transaction and update balance and
+    # portfolio as one atomic unit
     current_user = get_jwt_identity()
     user = find_user_by_username(current_user)
-    if user['balance'] < (price * quantity):
-        return jsonify({"message": "Not enough balance"}), 400
-
-    # Record the transaction in TinyDB
-    stock_transactions.insert({
-        'uid': user.doc_id,
-        'ticker': ticker,
-        'action': 'BUY',
-        'quantity': quantity,
-        'price': price,
-        'created_at': datetime.now(timezone.utc).isoformat()
-    })
-    
-    # Update the user's balance
-    new_balance = user['balance'] - (price * quantity)
-    users_table.update({'balance': new_balance}, Query().username == current_user)
-    
-    # Update or add to the portfolio
-    portfolio_item = portfolio_table.get((Query().ticker == ticker) & (Query().uid == user.doc_id))
-    if portfolio_item:
-        portfolio_table.update({'total_quantity': portfolio_item['total_quantity'] + quantity , 'updated_at': datetime.now(timezone.utc).isoformat()}, (Query().ticker == ticker) & (Query().uid == user.doc_id))
-    else:
-        portfolio_table.insert({'uid': user.doc_id ,'ticker': ticker, 'total_quantity': quantity, 'created_at': datetime.now(timezone.utc).isoformat()})
+    try:
+        trade_engine.execute_trade(user['id'], ticker, 'BUY', quantity, price)
+    except trade_engine.TradeError as e:
+        return jsonify({"message": str(e)}), 400
 
     return jsonify({"message": "Stock purchased successfully!"})
 
@@ -231,51 +468,68 @@ def sell_stock():
     # Check portfolio for available stock
     current_user = get_jwt_identity()
     user = find_user_by_username(current_user)
-    portfolio_item = portfolio_table.get((Query().ticker == ticker) & (Query().uid == user.doc_id))
+    portfolio_item = repository.get_position(user['id'], ticker)
     if not portfolio_item or portfolio_item['total_quantity'] < quantity:
         return jsonify({"message": "Not enough stock to sell"}), 400
 
-    # Fetch current stock price
-    stock = get_cached_stock(ticker)
-    price = stock.history(period="1d")['Close'][0]
-
-    # Record the transaction in TinyDB
-    stock_transactions.insert({
-        'uid': user.doc_id,
-        'ticker': ticker,
-        'action': 'SELL',
-        'quantity': quantity,
-        'price': price,
-        'created_at': datetime.now(timezone.utc).isoformat()
-    })
+    # Trades fill only at a fresh quote, never a stale or fallback one
+    quote = market_data.get_quote(ticker, allow_stale=False)
+    if not quote:
+        return price_unavailable(ticker)
+    price = quote['price']
+
+    # Holdings are checked again inside the trade, which records the
+    # transaction and updates balance and portfolio atomically
+    try:
+        trade_engine.execute_trade(user['id'], ticker, 'SELL', quantity, price)
+    except trade_engine.TradeError as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify({"message": "Stock sold successfully!"})
+
+MAX_BATCH_ORDERS = int(os.environ.get('MAX_BATCH_ORDERS', 100))
+
+# Endpoint: submit several buy/sell orders at once, e.g. to rebalance.
+# Body: {"orders": [{"ticker": ..., "action": "buy"|"sell", "quantity": ...}]}.
+# The basket is priced with one batch of fresh quotes and either every
+# order is filled in a single write or none is; sells fund the buys
+@app.route('/orders/batch', methods=['POST'])
+@jwt_required()
+def submit_orders():
+    data = request.json
+    orders = data.get('orders') if isinstance(data, dict) else None
+    if not isinstance(orders, list) or not orders:
+        return jsonify({"message": "orders must be a non-empty list"}), 400
+    if len(orders) > MAX_BATCH_ORDERS:
+        return jsonify({"message": f"At most {MAX_BATCH_ORDERS} orders per batch"}), 400
+    if not all(isinstance(order, dict) and isinstance(order.get('ticker'), str) for order in orders):
+        return jsonify({"message": "Every order needs a ticker"}), 400
+    orders = [(order['ticker'], str(order.get('action', '')).upper(), order.get('quantity')) for order in orders]
+
+    quotes = market_data.get_quotes([ticker for ticker, _, _ in orders], allow_stale=False)
+    prices = {ticker: quote['price'] for ticker, quote in quotes.items()}
 
-    # Update the user's balance
     current_user = get_jwt_identity()
     user = find_user_by_username(current_user)
-    new_balance = user['balance'] + (price * quantity)
-    users_table.update({'balance': new_balance}, Query().username == current_user)
-    
-    # Update the portfolio
-    new_quantity = portfolio_item['total_quantity'] - quantity
-    if new_quantity == 0:
-        portfolio_table.remove((Query().ticker == ticker) & (Query().uid == user.doc_id))
-    else:
-        portfolio_table.update({'total_quantity': new_quantity, 'updated_at': datetime.now(timezone.utc).isoformat()}, (Query().ticker == ticker) & (Query().uid == user.doc_id))
+    try:
+        filled = trade_engine.execute_orders(user['id'], orders, prices)
+    except trade_engine.OrdersRejected as e:
+        return jsonify({"message": str(e), "orders": e.results}), 400
+    except trade_engine.TradeError as e:
+        return jsonify({"message": str(e)}), 400
 
-    return jsonify({"message": "Stock sold successfully!"})
+    return jsonify({"message": "Orders filled successfully!", "balance": filled['balance'], "orders": filled['results']})
 
 
 # Endpoint: Get Stock Price, not using path parameters
 @app.route('/stock', methods=['GET'])
 def get_stock():
     ticker = request.args.get('stock')
-    stock = get_cached_stock(ticker)
-    # print everything in the stock object
-    data = stock.history(period="1d")
-    if len(data['Close']) > 0:
+    quote = market_data.get_quote(ticker)
+    if quote:
         return jsonify({
             "ticker": ticker,
-            "price": data['Close'][0]
+            "price": quote['price']
         })
     else:
         return jsonify({
@@ -287,8 +541,6 @@ def get_stock():
 @app.route('/listBySymbol', methods=['GET'])
 def get_stock_by_symbol():
     symbol = request.args.get('symbol')
-    stock = get_cached_stock(symbol)
-    stock_info = stock.info
 
     result = {
         "total": 0,
@@ -297,17 +549,15 @@ def get_stock_by_symbol():
         "total_pages": 1
     }
     
-    # Extract relevant data
-    company_name = stock_info.get('longName', 'N/A')
-    history_price = stock.history(period="1d")
-    
-    if len(history_price['Close']) <= 0:
+    quote = market_data.get_quote(symbol)
+    if not quote:
         return jsonify(result)
     
-    current_price = history_price['Close'][0]
-    previous_close = stock_info.get('regularMarketPreviousClose', 'N/A')
-    day_change = current_price - previous_close if current_price != 'N/A' and previous_close != 'N/A' else 'N/A'
-    day_change_percent = (day_change / previous_close) * 100 if day_change != 'N/A' and previous_close != 'N/A' else 'N/A'
+    # Extract relevant data
+    stock_info = market_data.get_info(symbol)
+    company_name = stock_info.get('company_name', 'N/A')
+    current_price = quote['price']
+    day_change, day_change_percent = get_day_change(quote)
     volume = stock_info.get('volume', 'N/A')
     
     stock_data = {
@@ -330,47 +580,41 @@ def get_stock_by_symbol():
     return jsonify(result)
         
 
-# Endpoint: Get top stocks by sector
-@app.route('/listBySector', methods=['GET'])
-def get_sectors():
-    sector = request.args.get('sector')
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    
-    sector_data = yf.Sector(sector)
-    print(sector_data.overview.get('companies_count'))
-    top_companies_df = sector_data.top_companies
-    
-    # sector_data.top_companies is a DataFrame. You can iterate over it to get the top companies in the sector
-    companies = top_companies_df.index.tolist()
+def build_sector_page(sector, page, per_page):
+    # Full /listBySector payload for one page, plus the tickers it shows
+    companies = market_data.get_sector_companies(sector)
     total_num_companies = len(companies)
     start = (page - 1) * per_page
     end = start + per_page
     page_companies = companies[start:end]
     
-    stock_list = get_cached_stock_list(page_companies)
+    quotes = market_data.get_quotes(page_companies)
+    histories = market_data.get_histories(page_companies, period="1mo")
+    infos = market_data.get_infos(page_companies)
     
     stock_data = []
-    for stock in stock_list:
+    for ticker in page_companies:
+        quote = quotes.get(ticker)
+        if not quote:
+            continue
+
         # Get stock information
-        stock_info = stock.info
+        stock_info = infos.get(ticker, {})
 
         # Extract relevant data
-        ticker = stock_info.get('symbol', 'N/A')  # Ticker Symbol
-        company_name = stock_info.get('longName', 'N/A')  # Company Name
-        history_price = stock.history(period="1d")
-        current_price = history_price['Close'][0]  # Current Price
-        previous_close = stock_info.get('regularMarketPreviousClose', 'N/A')  # Previous Close Price
-        day_change = current_price - previous_close if current_price != 'N/A' and previous_close != 'N/A' else 0  # Change in a day
-        day_change_percent = (day_change / previous_close) * 100 if day_change != 'N/A' and previous_close != 'N/A' else 0
+        company_name = stock_info.get('company_name', 'N/A')  # Company Name
+        current_price = quote['price']  # Current Price
+        day_change, day_change_percent = get_day_change(quote)  # Change in a day
+        if day_change == 'N/A':
+            day_change, day_change_percent = 0, 0
         volume = stock_info.get('volume', 'N/A')  # Volume
-        historical_data = stock.history(period="1mo")
-        historical_dates = historical_data.index.strftime('%Y-%m-%d').tolist()
-        historical_prices = historical_data['Close'].round(2).tolist()
+        historical_data = histories.get(ticker, {'dates': [], 'prices': []})
+        historical_dates = historical_data['dates']
+        historical_prices = historical_data['prices']
         stock_data.append({
             'ticker': ticker,
             'company_name': company_name,
-            'current_price': current_price.round(2),
+            'current_price': round(current_price, 2),
             'day_change': day_change,
             'day_change_percent': day_change_percent,
             "historical_dates": historical_dates,
@@ -386,7 +630,70 @@ def get_sectors():
         "data": stock_data
     }
     
-    return jsonify(result)
+    return result, page_companies
+
+# /listBySector responses are precomputed per (sector, page, per_page) and
+# rebuilt whenever the quotes behind them are refreshed
+sector_pages = SectorPages(
+    build_sector_page,
+    app.json.dumps,
+    max_age=quote_cache.ttls['quote'],
+    max_pages=int(os.environ.get('SECTOR_PAGES_MAX', 1000)),
+)
+market_data.add_quote_listener(sector_pages.on_quotes)
+
+# Endpoint: Get top stocks by sector
+@app.route('/listBySector', methods=['GET'])
+def get_sectors():
+    sector = request.args.get('sector')
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 10, type=int)
+    if not sector or page < 1 or not 1 <= per_page <= 100:
+        return jsonify({"message": "sector, page >= 1 and 1 <= per_page <= 100 are required"}), 400
+
+    entry = sector_pages.get(sector, page, per_page)
+    response = app.response_class(entry['body'], mimetype='application/json')
+    response.set_etag(entry['etag'])
+    # Clients must revalidate, which is a 304 while the page is unchanged
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# Endpoint: quote cache hit/miss/eviction and request coalescing counters
+@app.route('/cacheStats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(dict(market_data.stats(), sector_pages=sector_pages.stats(), users=user_cache.stats(),
+                        auth=password_hasher.stats(), quote_stream=quote_stream.stats()))
+
+def metric_gauges():
+    # Point-in-time cache, pool and breaker state sampled for /metrics
+    market = market_data.stats()
+    users = user_cache.stats()
+    auth = password_hasher.stats()
+    caches = (('market_data', market), ('users', users))
+    for name, help_text, key in (
+        ('cache_hits', 'Cache hits since start', 'hits'),
+        ('cache_misses', 'Cache misses since start', 'misses'),
+        ('cache_hit_ratio', 'Cache hits / lookups', 'hit_ratio'),
+        ('cache_entries', 'Entries held in the cache', 'entries'),
+    ):
+        for cache, stats in caches:
+            yield name, help_text, {'cache': cache}, stats[key]
+    yield 'cache_stale_hits', 'Expired quotes served while refreshing', {}, market['stale_hits']
+    yield 'cache_fallbacks', 'Cached values served because upstream failed', {}, market['fallbacks']
+    yield 'cache_bytes', 'Estimated size of the market data cache', {}, market['bytes']
+    yield 'cache_evictions', 'Market data cache evictions since start', {}, market['evictions']
+    yield 'upstream_coalesced', 'Fetches that joined one already in flight', {}, market['coalesced']
+    yield 'upstream_circuit_open', '1 while the upstream circuit breaker rejects calls', {}, \
+        market['circuit_state'] != 'closed'
+    yield 'sector_pages', 'Precomputed /listBySector pages', {}, sector_pages.stats()['pages']
+    yield 'quote_stream_subscribers', 'Open /stream/quotes connections', {}, quote_stream.stats()['subscribers']
+    yield 'password_hash_pending', 'Password hash/check calls queued or running', {}, auth['pending']
+    yield 'logins_per_minute', 'Login attempts over the last minute', {}, auth['logins_per_minute']
+
+# Endpoint: metrics in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return app.response_class(metrics.render(metric_gauges()), mimetype='text/plain; version=0.0.4')
 
 # Endpoint: get users' balance
 @app.route('/balance', methods=['GET'])
@@ -404,8 +711,10 @@ def deposit():
     amount = data['amount']
     current_user = get_jwt_identity()
     user = find_user_by_username(current_user)
-    new_balance = user['balance'] + amount if 'balance' in user else amount
-    users_table.update({'balance': new_balance}, Query().username == current_user)
+    try:
+        trade_engine.deposit(user['id'], amount)
+    except trade_engine.TradeError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify({"message": "Deposit successful!"})
 
 # Endpoint: withdraw money
@@ -416,10 +725,10 @@ def withdraw():
     amount = data['amount']
     current_user = get_jwt_identity()
     user = find_user_by_username(current_user)
-    if user['balance'] < amount:
-        return jsonify({"error": "Not enough balance"}), 400
-    new_balance = user['balance'] - amount
-    users_table.update({'balance': new_balance}, Query().username == current_user)
+    try:
+        trade_engine.withdraw(user['id'], amount)
+    except trade_engine.TradeError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify({"message": "Withdrawal successful!"})
 
 # Endpoint: get user total asset value (balance + stock value) every day
@@ -427,46 +736,46 @@ def withdraw():
 @jwt_required()
 def get_asset():
     current_user = get_jwt_identity()
-    print("current_user", current_user)
     user = find_user_by_username(current_user)
-    print("user", user)
     balance = user['balance']
-    total_value = balance
-    labels = []
-    values = []
-    
-    # get history asset value
-    history_asset = history_asset_table.search(Query().uid == user.doc_id)
-    for asset in history_asset:
-        labels.append(asset['date'])
-        values.append(asset['total_value'])
+    # range: 1m, 3m, 6m, 1y, 5y, 10y or all; resolution: daily, weekly, monthly
+    # or auto (the finest that keeps the chart to a few hundred points)
+    range_name = request.args.get('range', 'all')
+    resolution = request.args.get('resolution', 'auto')
+    if range_name != 'all' and range_name not in asset_series.RANGES:
+        return jsonify({"error": "Invalid range"}), 400
+    if resolution != 'auto' and resolution not in asset_series.RESOLUTIONS:
+        return jsonify({"error": "Invalid resolution"}), 400
+    
+    portfolio = repository.get_positions(user['id'])
+    quotes = market_data.get_quotes([stock['ticker'] for stock in portfolio])
+    return jsonify(asset_history(user, range_name, resolution, valuation.total_value(portfolio, quotes, balance)))
+
+def asset_history(user, range_name, resolution, total_value):
+    # get history asset value from the pre-aggregated series
+    labels, values = asset_series.query(user['id'], range_name, resolution)
     
     # get today date as yyyy-mm-dd
     now = datetime.now().isoformat()
     today = now.split('T')[0]
     
+    # today's point is the live value
     labels.append(today)
-    portfolio = portfolio_table.search(Query().uid == user.doc_id)
-    for stock in portfolio:
-        ticker = stock['ticker']
-        quantity = stock['total_quantity']
-        stock = get_cached_stock(ticker)
-        price = stock.history(period="1d")['Close'][0]
-        total_value += price * quantity
     values.append(total_value)
-    
-    result = {"labels": labels, "values": values}
-    return jsonify(result)
+    return {"labels": labels, "values": values}
 
 # Endpoint: update user's portfolio every day
 @app.route('/updatePortfolio', methods=['POST'])
 def update_portfolio():
     username = request.json.get('username')
-    date = request.json.get('date')
+    try:
+        # Stored as YYYY-MM-DD; the asset series index rows by day
+        asset_date = date.fromisoformat(request.json.get('date')).isoformat()
+    except (TypeError, ValueError):
+        return jsonify({"error": "date must be a YYYY-MM-DD date"}), 400
     user = find_user_by_username(username)
     total_value = request.json.get('total_value')
-    user_id = user.doc_id
-    history_asset_table.upsert({'uid': user_id, 'total_value': total_value, 'date': date}, (Query().uid == user_id) & (Query().date == date))
+    repository.upsert_asset_history(user['id'], asset_date, total_value)
     return jsonify({"message": "Portfolio updated successfully!"})
 
 # Endpoint: get a user's watchlist
@@ -475,18 +784,46 @@ def update_portfolio():
 def get_watchlist():
     current_user = get_jwt_identity()
     user = find_user_by_username(current_user)
-    watchlist = user.get('watchlist', [])
+    watchlist = repository.get_watchlist(user['id'])
+    # One bulk quote lookup through the shared cache
+    return jsonify(watchlist_rows(watchlist, dict(zip(watchlist, market_data.get_many(watchlist)))))
+
+def watchlist_rows(watchlist, quotes):
     result = []
     for symbol in watchlist:
-        stock = yf.Ticker(symbol)
-        stock_info = stock.info
-        price = stock.history(period="1d")['Close'][0]
+        quote = quotes.get(symbol)
+        if not quote:
+            continue
+        day_change, day_change_percent = get_day_change(quote)
         result.append({
             'symbol': symbol,
-            'price': round(price, 2)
+            'price': round(quote['price'], 2),
+            'day_change': round(day_change, 2) if day_change != 'N/A' else day_change,
+            'day_change_percent': round(day_change_percent, 2) if day_change_percent != 'N/A' else day_change_percent
         })
-        
-    return jsonify(result)
+    return result
+
+# Endpoint: watchlists of many users at once, for server-rendered dashboards.
+# Internal only: requires the X-Internal-Token header to match INTERNAL_API_TOKEN
+@app.route('/watchlists', methods=['GET'])
+def get_watchlists():
+    token = os.environ.get('INTERNAL_API_TOKEN')
+    if not token or not hmac.compare_digest(request.headers.get('X-Internal-Token', ''), token):
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        uids = [int(uid) for uid in request.args.get('uids', '').split(',') if uid]
+    except ValueError:
+        return jsonify({"error": "uids must be a comma-separated list of user ids"}), 400
+    if not 1 <= len(uids) <= 1000:
+        return jsonify({"error": "Between 1 and 1000 uids are required"}), 400
+
+    watchlists = repository.get_watchlists(uids)
+    # Every symbol across all the watchlists in one bulk lookup
+    symbols = list(dict.fromkeys(symbol for watchlist in watchlists.values() for symbol in watchlist))
+    quotes = dict(zip(symbols, market_data.get_many(symbols)))
+    return jsonify({
+        str(uid): watchlist_rows(watchlist, quotes) for uid, watchlist in watchlists.items()
+    })
 
 # Endpoint: add a stock to a user's watchlist
 @app.route('/watchlist', methods=['POST'])
@@ -496,10 +833,7 @@ def add_to_watchlist():
     user = find_user_by_username(current_user)
     data = request.json
     symbol = data['symbol']
-    watchlist = user.get('watchlist', [])
-    if symbol not in watchlist:
-        watchlist.append(symbol)
-        users_table.update({'watchlist': watchlist}, Query().username == current_user)
+    repository.add_to_watchlist(user['id'], symbol)
     return jsonify({"message": "Stock added to watchlist!"})
 
 # Endpoint: remove a stock from a user's watchlist
@@ -509,36 +843,144 @@ def remove_from_watchlist():
     current_user = get_jwt_identity()
     user = find_user_by_username(current_user)
     symbol = request.args.get('symbol')
-    watchlist = user.get('watchlist', [])
-    if symbol in watchlist:
-        watchlist.remove(symbol)
-        users_table.update({'watchlist': watchlist}, Query().username == current_user)
+    repository.remove_from_watchlist(user['id'], symbol)
     return jsonify({"message": "Stock removed from watchlist!"})
 
+# Live quotes for open /stream/quotes connections, pushed as the background
+# refresher (or any request) fetches new prices
+quote_stream = QuoteStream(max_subscribers=int(os.environ.get('QUOTE_STREAM_MAX_SUBSCRIBERS', 100)))
+market_data.add_quote_listener(quote_stream.on_quotes)
+QUOTE_STREAM_HEARTBEAT = float(os.environ.get('QUOTE_STREAM_HEARTBEAT_SECONDS', 15))
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+# Endpoint: server-sent events with prices for the user's portfolio and
+# watchlist tickers. The first "snapshot" event has every ticker; after
+# that each "quotes" event has only the tickers whose price changed, in
+# the /watchlist row format. Comment lines keep idle connections open.
+# Browsers' EventSource cannot set headers, so ?jwt=<token> is accepted too
+@app.route('/stream/quotes', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_quotes():
+    current_user = get_jwt_identity()
+    user = find_user_by_username(current_user)
+    tickers = list(dict.fromkeys([position['ticker'] for position in repository.get_positions(user['id'])]
+                                 + repository.get_watchlist(user['id'])))
+    # Subscribe before reading the snapshot so no update in between is lost
+    subscription = quote_stream.subscribe(tickers)
+    if subscription is None:
+        response = jsonify({"error": "Too many open quote streams, please retry shortly"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    try:
+        quotes = market_data.get_quotes(tickers)
+        subscription.mark_sent(quotes)
+        snapshot = watchlist_rows(tickers, quotes)
+    except BaseException:
+        quote_stream.unsubscribe(subscription)
+        raise
+
+    def generate():
+        try:
+            yield sse_event('snapshot', snapshot)
+            while True:
+                quotes = subscription.wait(QUOTE_STREAM_HEARTBEAT)
+                if quotes:
+                    yield sse_event('quotes', watchlist_rows(sorted(quotes), quotes))
+                else:
+                    yield ': keep-alive\n\n'
+        finally:
+            # Runs when the client disconnects and the server closes the generator
+            quote_stream.unsubscribe(subscription)
+
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # Endpoint: get user's asset constituents
 @app.route('/assetConstituents', methods=['GET'])
 @jwt_required()
 def get_asset_constitution():
     current_user = get_jwt_identity()
     user = find_user_by_username(current_user)
-    portfolio = portfolio_table.search(Query().uid == user.doc_id)
+    portfolio = repository.get_positions(user['id'])
     balance = user['balance']
+    quotes = market_data.get_quotes([stock['ticker'] for stock in portfolio])
+    return jsonify(asset_constituents(valuation.value_positions(portfolio, quotes, balance), balance))
+
+def asset_constituents(valued, balance):
+    # Cash plus every priced position, each with its share of the total
     result = []
-    
+    total_value = valued['market_value'].sum() + balance
     result.append({
         'name': 'balance',
-        'value': balance
+        'value': balance,
+        'weight': float(balance / total_value) if total_value else 0.0
     })
-    for stock in portfolio:
-        ticker = stock['ticker']
-        quantity = stock['total_quantity']
-        stock = get_cached_stock(ticker)
-        price = stock.history(period="1d")['Close'][0]
-        total_value = price * quantity
+    for row in valued.itertuples(index=False):
         result.append({
-            'name': ticker,
-            'value': total_value
+            'name': row.ticker,
+            'value': float(row.market_value),
+            'weight': float(row.weight)
         })
+    return result
+
+# Sections /dashboard can return; select some with ?fields=balance,watchlist
+DASHBOARD_SECTIONS = ('balance', 'asset', 'assetConstituents', 'portfolio', 'watchlist')
+
+# Endpoint: everything the dashboard renders in one round trip. The user is
+# loaded once and the quotes for every section come from one batch lookup
+@app.route('/dashboard', methods=['GET'])
+@jwt_required()
+def get_dashboard():
+    fields = request.args.get('fields')
+    sections = [field for field in fields.split(',') if field] if fields else list(DASHBOARD_SECTIONS)
+    unknown = [field for field in sections if field not in DASHBOARD_SECTIONS]
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+    per_page = request.args.get('per_page', 10, type=int)
+    if not 1 <= per_page <= 100:
+        return jsonify({"error": "per_page must be between 1 and 100"}), 400
+    range_name = request.args.get('range', 'all')
+    resolution = request.args.get('resolution', 'auto')
+    if range_name != 'all' and range_name not in asset_series.RANGES:
+        return jsonify({"error": "Invalid range"}), 400
+    if resolution != 'auto' and resolution not in asset_series.RESOLUTIONS:
+        return jsonify({"error": "Invalid resolution"}), 400
+
+    current_user = get_jwt_identity()
+    user = find_user_by_username(current_user)
+    balance = user['balance']
+    needs_positions = any(field in sections for field in ('asset', 'assetConstituents', 'portfolio'))
+    portfolio = repository.get_positions(user['id']) if needs_positions else []
+    watchlist = repository.get_watchlist(user['id']) if 'watchlist' in sections else []
+    quotes = market_data.get_quotes([stock['ticker'] for stock in portfolio] + watchlist)
+
+    result = {}
+    if 'balance' in sections:
+        result['balance'] = balance
+    if 'asset' in sections or 'assetConstituents' in sections:
+        valued = valuation.value_positions(portfolio, quotes, balance)
+        if 'asset' in sections:
+            total_value = float(valued['market_value'].sum() + balance)
+            result['asset'] = asset_history(user, range_name, resolution, total_value)
+        if 'assetConstituents' in sections:
+            result['assetConstituents'] = asset_constituents(valued, balance)
+    if 'portfolio' in sections:
+        # First page, same shape as /portfolio
+        page_portfolios, next_cursor = paginate(portfolio[:per_page + 1], per_page, lambda row: [row['id']])
+        result['portfolio'] = {
+            "total": len(portfolio),
+            "page": 1,
+            "per_page": per_page,
+            "total_pages": math.ceil(len(portfolio) / per_page),
+            "next_cursor": next_cursor,
+            "data": portfolio_rows(user, page_portfolios, quotes)
+        }
+    if 'watchlist' in sections:
+        result['watchlist'] = watchlist_rows(watchlist, quotes)
     return jsonify(result)
 
 if __name__ == '__main__':
@@ -0,0 +1,115 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+import numpy as np
+
+from database import db
+
+# Per-user asset history in columnar form: one row per (uid, resolution)
+# holding a sorted int32 array of days since 1970-01-01 and a float64
+# array of values. Weekly and monthly rollups keep the last value of each
+# bucket and are rebuilt whenever the daily series changes, so reads never
+# touch the raw history_asset rows.
+
+RESOLUTIONS = ('daily', 'weekly', 'monthly')
+
+RANGES = {
+    '1m': 31,
+    '3m': 92,
+    '6m': 183,
+    '1y': 366,
+    '5y': 5 * 366,
+    '10y': 10 * 366,
+}
+
+EPOCH = date(1970, 1, 1)
+
+
+def to_days(iso_date):
+    return (date.fromisoformat(iso_date) - EPOCH).days
+
+
+def to_iso(days):
+    return (EPOCH + timedelta(days=int(days))).isoformat()
+
+
+def _bucket_keys(days, resolution):
+    if resolution == 'weekly':
+        # Weeks start on Monday; 1970-01-01 was a Thursday
+        return (days + 3) // 7
+    if resolution == 'monthly':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    return days
+
+
+def rollup(days, values, resolution):
+    # Keep the last point of every bucket
+    if resolution == 'daily' or len(days) == 0:
+        return days, values
+    keys = _bucket_keys(days.astype(np.int64), resolution)
+    last = np.flatnonzero(np.diff(keys, append=keys[-1] + 1))
+    return days[last], values[last]
+
+
+def load(uid, resolution='daily'):
+    row = db.query_one(
+        'SELECT days, vals FROM asset_series WHERE uid = ? AND resolution = ?', (uid, resolution)
+    )
+    if row is None:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+    return np.frombuffer(row['days'], dtype=np.int32), np.frombuffer(row['vals'], dtype=np.float64)
+
+
+def _store(uid, days, values):
+    db.executemany(
+        'INSERT INTO asset_series (uid, resolution, days, vals) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT (uid, resolution) DO UPDATE SET days = excluded.days, vals = excluded.vals',
+        [(uid, resolution, series_days.astype(np.int32).tobytes(), series_values.astype(np.float64).tobytes())
+         for resolution in RESOLUTIONS
+         for series_days, series_values in [rollup(days, values, resolution)]],
+    )
+
+
+def record(rows):
+    """Merge (uid, iso_date, total_value) points into the stored series."""
+    points = defaultdict(dict)
+    for uid, iso_date, total_value in rows:
+        points[uid][to_days(iso_date)] = total_value
+
+    with db.transaction():
+        for uid, new_points in points.items():
+            days, values = load(uid)
+            merged = dict(zip(days.tolist(), values.tolist()))
+            merged.update(new_points)
+            merged_days = np.fromiter(sorted(merged), dtype=np.int32, count=len(merged))
+            merged_values = np.fromiter((merged[d] for d in merged_days.tolist()), dtype=np.float64,
+                                        count=len(merged))
+            _store(uid, merged_days, merged_values)
+
+
+def rebuild(uid=None):
+    # Recreate the series from the raw history_asset rows
+    where, params = ('WHERE uid = ?', (uid,)) if uid is not None else ('', ())
+    with db.transaction():
+        db.execute(f'DELETE FROM asset_series {where}', params)
+        rows = db.query(f'SELECT uid, date, total_value FROM history_asset {where} ORDER BY uid, date', params)
+        record((row['uid'], row['date'], row['total_value']) for row in rows)
+
+
+def query(uid, range_name='all', resolution='auto', today=None, max_points=400):
+    """Return (labels, values) for a chart over `range_name` ('1m' ... '10y'
+    or 'all') at `resolution` ('daily', 'weekly', 'monthly' or 'auto').
+
+    'auto' picks the finest resolution with at most `max_points` points.
+    """
+    today = today or date.today()
+    start = (today - EPOCH).days - RANGES[range_name] if range_name in RANGES else None
+
+    for candidate in (RESOLUTIONS if resolution == 'auto' else (resolution,)):
+        days, values = load(uid, candidate)
+        if start is not None:
+            cut = np.searchsorted(days, start)
+            days, values = days[cut:], values[cut:]
+        if len(days) <= max_points:
+            break
+    return [to_iso(d) for d in days.tolist()], values.tolist()
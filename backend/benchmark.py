@@ -0,0 +1,282 @@
+"""Load test and benchmark for the backend.
+
+Generates a synthetic dataset in a throwaway database, boots app.py on a
+threaded local server against the offline fake market data provider, and
+drives a weighted mix of endpoints from concurrent clients. Reports p50,
+p95 and p99 latency and requests/s per endpoint and writes them to a JSON
+file; pass --compare with an earlier file to see the change.
+
+Usage: python benchmark.py [--users 200] [--positions 10] [--transactions 50]
+                           [--clients 16] [--duration 30] [--output benchmark.json]
+                           [--compare previous.json]
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+PASSWORD = 'benchmark'
+
+# Relative weight of each endpoint in the default mix
+DEFAULT_MIX = {
+    'login': 2,
+    'portfolio': 25,
+    'transactions': 15,
+    'buy': 8,
+    'sell': 7,
+    'asset': 18,
+    'listBySector': 25,
+}
+
+
+def generate_dataset(database, users, positions, transactions, watchlist_size, history_days,
+                     tickers, password_hash, seed=0):
+    """Fill an empty database with `users` accounts, each holding `positions`
+    tickers built up by `transactions` trades, a watchlist and
+    `history_days` of daily asset history. Returns the usernames."""
+    rng = random.Random(seed)
+    prices = {ticker: 20 + rng.random() * 480 for ticker in tickers}
+    start = datetime.now(timezone.utc) - timedelta(days=max(history_days, 1))
+    usernames = [f'bench{i}@test.com' for i in range(users)]
+
+    user_rows, position_rows, transaction_rows, watchlist_rows, history_rows = [], [], [], [], []
+    for uid, username in enumerate(usernames, start=1):
+        user_rows.append((uid, username, password_hash, 100000.0, start.isoformat()))
+        held = rng.sample(tickers, min(positions, len(tickers)))
+        holdings = defaultdict(int)
+        for n in range(max(transactions, len(held))):
+            # Every held ticker is bought once before any random trading
+            ticker = held[n] if n < len(held) else rng.choice(held)
+            sell = n >= len(held) and holdings[ticker] > 1 and rng.random() < 0.4
+            quantity = rng.randint(1, holdings[ticker] - 1) if sell else rng.randint(1, 20)
+            holdings[ticker] += -quantity if sell else quantity
+            created_at = start + timedelta(minutes=n * 7 + rng.randint(0, 6))
+            transaction_rows.append((uid, ticker, 'SELL' if sell else 'BUY', quantity,
+                                     round(prices[ticker] * rng.uniform(0.8, 1.2), 2), created_at.isoformat()))
+        for ticker, quantity in holdings.items():
+            position_rows.append((uid, ticker, quantity, start.isoformat()))
+        for position, ticker in enumerate(rng.sample(tickers, min(watchlist_size, len(tickers)))):
+            watchlist_rows.append((uid, ticker, position))
+        value = 100000.0
+        for day in range(history_days):
+            value *= 1 + rng.uniform(-0.02, 0.021)
+            history_rows.append((uid, round(value, 2), (date.today() - timedelta(days=history_days - day)).isoformat()))
+
+    with database.transaction():
+        database.executemany(
+            'INSERT INTO users (id, username, password, balance, created_at) VALUES (?, ?, ?, ?, ?)', user_rows)
+        database.executemany(
+            'INSERT INTO portfolio (uid, ticker, total_quantity, created_at) VALUES (?, ?, ?, ?)', position_rows)
+        database.executemany(
+            'INSERT INTO stock_transactions (uid, ticker, action, quantity, price, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)', transaction_rows)
+        database.executemany('INSERT INTO watchlist (uid, ticker, position) VALUES (?, ?, ?)', watchlist_rows)
+        database.executemany('INSERT INTO history_asset (uid, total_value, date) VALUES (?, ?, ?)', history_rows)
+    return usernames
+
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, (text or '').split(',')):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f'unknown endpoint in --mix: {name}')
+        mix[name] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    # samples: [(endpoint, seconds, status)]
+    groups = defaultdict(list)
+    for endpoint, seconds, status in samples:
+        groups[endpoint].append((seconds, status))
+        groups['all'].append((seconds, status))
+    report = {}
+    for endpoint, rows in sorted(groups.items()):
+        latencies = sorted(seconds * 1000 for seconds, _ in rows)
+        report[endpoint] = {
+            'requests': len(rows),
+            'errors': sum(1 for _, status in rows if status is None or status >= 500),
+            'rejected': sum(1 for _, status in rows if status is not None and 400 <= status < 500),
+            'requests_per_second': round(len(rows) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'max_ms': round(latencies[-1], 2),
+        }
+    return report
+
+
+def print_report(report, previous=None):
+    print(f"{'endpoint':<14}{'reqs':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for endpoint, row in report.items():
+        line = (f"{endpoint:<14}{row['requests']:>8}{row['requests_per_second']:>9}{row['p50_ms']:>9}"
+                f"{row['p95_ms']:>9}{row['p99_ms']:>9}{row['errors']:>8}")
+        before = (previous or {}).get(endpoint)
+        if before:
+            def change(key):
+                return f"{(row[key] - before[key]) / before[key] * 100:+.0f}%" if before[key] else 'n/a'
+            line += f"   vs previous: req/s {change('requests_per_second')}, p95 {change('p95_ms')}"
+        print(line)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the backend with a synthetic dataset')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--positions', type=int, default=10, help='tickers held per user')
+    parser.add_argument('--transactions', type=int, default=50, help='transactions per user')
+    parser.add_argument('--watchlist', type=int, default=12, help='watchlist symbols per user')
+    parser.add_argument('--history-days', type=int, default=365)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds before the run')
+    parser.add_argument('--mix', help='endpoint weights, e.g. portfolio=30,buy=0')
+    parser.add_argument('--upstream-latency', type=float, default=0.05,
+                        help='simulated market data round trip in seconds')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+    output = os.path.abspath(args.output)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'benchmark.db')
+    os.environ['PRICE_HISTORY_DIR'] = os.path.join(workdir, 'price_history')
+    os.environ['MARKET_DATA_PROVIDER'] = 'fake'
+    os.environ['PRICE_REFRESH_INTERVAL'] = '0'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.chdir(workdir)  # keep the app from importing a local stocks.json
+
+    from database import db
+    from market_data import FAKE_SECTORS
+    from password_hasher import _hash
+
+    db.init_schema()
+    tickers = sorted({ticker for companies in FAKE_SECTORS.values() for ticker in companies})
+    started = time.perf_counter()
+    usernames = generate_dataset(db, args.users, args.positions, args.transactions, args.watchlist,
+                                 args.history_days, tickers, _hash(PASSWORD, args.bcrypt_rounds), args.seed)
+    print(f'generated {args.users} users x {args.transactions} transactions in {time.perf_counter() - started:.1f}s')
+
+    # Importing the app builds the ledger and asset series for the new data
+    from flask_jwt_extended import create_access_token
+    from werkzeug.serving import make_server
+    from app import app, provider
+    import repository
+
+    provider.latency = args.upstream_latency
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # no access log per request
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+
+    with app.app_context():
+        tokens = {username: create_access_token(identity=username) for username in usernames}
+    held = {username: [row['ticker'] for row in repository.get_positions(uid)]
+            for uid, username in enumerate(usernames, start=1)}
+    sectors = sorted(FAKE_SECTORS)
+
+    def request(rng, endpoint, username):
+        headers = {'Authorization': f'Bearer {tokens[username]}', 'Content-Type': 'application/json'}
+        if endpoint == 'login':
+            return 'POST', '/login', {'email': username, 'password': PASSWORD}, {'Content-Type': 'application/json'}
+        if endpoint == 'portfolio':
+            return 'GET', '/portfolio', None, headers
+        if endpoint == 'transactions':
+            return 'GET', f'/transactions?page={rng.randint(1, max(1, args.transactions // 10))}', None, headers
+        if endpoint == 'buy':
+            return 'POST', '/buy', {'ticker': rng.choice(tickers), 'quantity': rng.randint(1, 5)}, headers
+        if endpoint == 'sell':
+            return 'POST', '/sell', {'ticker': rng.choice(held[username]), 'quantity': 1}, headers
+        if endpoint == 'asset':
+            return 'GET', f"/asset?range={rng.choice(['1m', '6m', '1y', 'all'])}", None, headers
+        return 'GET', f'/listBySector?sector={rng.choice(sectors)}&page={rng.randint(1, 2)}', None, {}
+
+    samples = []
+    samples_lock = threading.Lock()
+    measure_from = time.perf_counter() + args.warmup
+    stop_at = measure_from + args.duration
+    endpoints = list(mix)
+    weights = [mix[endpoint] for endpoint in endpoints]
+
+    def client(seed):
+        rng = random.Random(seed)
+        local = []
+        while time.perf_counter() < stop_at:
+            endpoint = rng.choices(endpoints, weights)[0]
+            method, path, body, headers = request(rng, endpoint, rng.choice(usernames))
+            sent = time.perf_counter()
+            status = None
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                                   headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+                connection.close()
+            except (OSError, http.client.HTTPException):
+                pass
+            if sent >= measure_from:
+                local.append((endpoint, time.perf_counter() - sent, status))
+        with samples_lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=client, args=(args.seed + i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    results = summarize(samples, args.duration)
+    print_report(results, previous)
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'mix': mix,
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'results written to {output}')
+    if results.get('all', {}).get('errors'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
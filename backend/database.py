@@ -1,11 +1,257 @@
-from tinydb import TinyDB, Query
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
-# Initialize the database
-db = TinyDB('stocks.json')
-Stock = Query()
+from metrics import metrics
 
-# Tables
-stock_transactions = db.table('stock_transactions')
-portfolio_table = db.table('portfolio')
-history_asset_table = db.table('history_asset')
-users_table = db.table('users')  # For user authentication
+# SQLite file holding every table; stocks.json is the legacy TinyDB store
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'stocks.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    balance REAL NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS watchlist (
+    uid INTEGER NOT NULL,
+    ticker TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (uid, ticker)
+);
+CREATE INDEX IF NOT EXISTS idx_watchlist_ticker ON watchlist (ticker);
+
+CREATE TABLE IF NOT EXISTS stock_transactions (
+    id INTEGER PRIMARY KEY,
+    uid INTEGER NOT NULL,
+    ticker TEXT NOT NULL,
+    action TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    price REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_uid_date ON stock_transactions (uid, created_at, id);
+-- Also serves ticker-filtered exports in date order
+DROP INDEX IF EXISTS idx_transactions_uid_ticker;
+CREATE INDEX IF NOT EXISTS idx_transactions_uid_ticker_date ON stock_transactions (uid, ticker, created_at, id);
+
+-- Per-user row counts kept by triggers, so totals never need a scan
+CREATE TABLE IF NOT EXISTS transaction_counts (
+    uid INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS trg_transactions_count_insert AFTER INSERT ON stock_transactions
+BEGIN
+    INSERT INTO transaction_counts (uid, count) VALUES (NEW.uid, 1)
+    ON CONFLICT (uid) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_transactions_count_delete AFTER DELETE ON stock_transactions
+BEGIN
+    UPDATE transaction_counts SET count = count - 1 WHERE uid = OLD.uid;
+END;
+
+CREATE TABLE IF NOT EXISTS portfolio (
+    id INTEGER PRIMARY KEY,
+    uid INTEGER NOT NULL,
+    ticker TEXT NOT NULL,
+    total_quantity INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_portfolio_uid_ticker ON portfolio (uid, ticker);
+CREATE INDEX IF NOT EXISTS idx_portfolio_uid ON portfolio (uid);
+CREATE INDEX IF NOT EXISTS idx_portfolio_ticker ON portfolio (ticker);
+
+-- Position ledger maintained on every trade; closed positions keep their
+-- realized P&L with quantity 0
+CREATE TABLE IF NOT EXISTS ledger_positions (
+    uid INTEGER NOT NULL,
+    ticker TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    cost_basis REAL NOT NULL,
+    realized_pnl REAL NOT NULL,
+    updated_at TEXT,
+    PRIMARY KEY (uid, ticker)
+);
+
+-- Open buy lots, consumed oldest first
+CREATE TABLE IF NOT EXISTS ledger_lots (
+    id INTEGER PRIMARY KEY,
+    uid INTEGER NOT NULL,
+    ticker TEXT NOT NULL,
+    transaction_id INTEGER,
+    quantity INTEGER NOT NULL,
+    price REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ledger_lots_uid_ticker ON ledger_lots (uid, ticker);
+
+-- Share quantities the transaction history does not explain (e.g. imported
+-- portfolios), recorded so replays agree with the portfolio; opening lots
+-- are positive, removals negative
+CREATE TABLE IF NOT EXISTS ledger_adjustments (
+    id INTEGER PRIMARY KEY,
+    uid INTEGER NOT NULL,
+    ticker TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    price REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ledger_adjustments_uid ON ledger_adjustments (uid, created_at, id);
+
+CREATE TABLE IF NOT EXISTS history_asset (
+    id INTEGER PRIMARY KEY,
+    uid INTEGER NOT NULL,
+    total_value REAL NOT NULL,
+    date TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_history_asset_uid_date ON history_asset (uid, date);
+
+-- history_asset as packed per-user arrays at daily/weekly/monthly resolution
+CREATE TABLE IF NOT EXISTS asset_series (
+    uid INTEGER NOT NULL,
+    resolution TEXT NOT NULL,
+    days BLOB NOT NULL,
+    vals BLOB NOT NULL,
+    PRIMARY KEY (uid, resolution)
+);
+"""
+
+
+class Database:
+    """SQLite database with one connection per thread.
+
+    Statements run in autocommit mode unless they are inside
+    `transaction()`, which may be nested (inner blocks become savepoints).
+    The database runs in write-ahead-log mode with a full sync on commit,
+    so every committed transaction is one durable append to the log.
+    Callbacks passed to `after_commit()` run once the enclosing outermost
+    transaction has committed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA busy_timeout = 30000')
+            conn.execute('PRAGMA synchronous = FULL')
+            self._local.conn = conn
+            self._local.depth = 0
+            self._local.after_commit = []
+        return conn
+
+    def init_schema(self):
+        self.connection().execute('PRAGMA journal_mode = WAL')
+        self.connection().executescript(SCHEMA)
+        # Databases created before the counts table existed need a backfill
+        if self.query_one('SELECT 1 AS found FROM transaction_counts LIMIT 1') is None:
+            self.execute(
+                'INSERT INTO transaction_counts (uid, count) '
+                'SELECT uid, COUNT(*) FROM stock_transactions GROUP BY uid'
+            )
+
+    def recover(self):
+        # Opening the database replays a log left behind by a crash; fold it
+        # into the main file and report how many log frames were applied
+        _, _, checkpointed = self.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        return max(checkpointed, 0)
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        depth = self._local.depth
+        savepoint = f'sp_{depth}'
+        callbacks = self._local.after_commit
+        registered = len(callbacks)
+        conn.execute('BEGIN IMMEDIATE' if depth == 0 else f'SAVEPOINT {savepoint}')
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            # Work rolled back here never commits, so neither do its callbacks
+            del callbacks[registered:]
+            if depth == 0:
+                conn.execute('ROLLBACK')
+            else:
+                conn.execute(f'ROLLBACK TO {savepoint}')
+                conn.execute(f'RELEASE {savepoint}')
+            raise
+        else:
+            if depth == 0:
+                started = time.perf_counter()
+                conn.execute('COMMIT')
+                self._record('commit', started)
+            else:
+                conn.execute(f'RELEASE {savepoint}')
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                # Callbacks only survive a successful outermost COMMIT
+                pending = callbacks[:]
+                del callbacks[:]
+        if depth == 0:
+            for callback in pending:
+                callback()
+
+    def after_commit(self, callback):
+        # Outside a transaction every statement commits on its own
+        self.connection()
+        if self._local.depth == 0:
+            callback()
+        else:
+            self._local.after_commit.append(callback)
+
+    @staticmethod
+    def _record(kind, started):
+        seconds = time.perf_counter() - started
+        metrics.observe('db_statement_duration_seconds', {'kind': kind}, seconds)
+        metrics.add_request('db', seconds)
+
+    @staticmethod
+    def _kind(sql):
+        return 'read' if sql.lstrip()[:6].upper() in ('SELECT', 'PRAGMA') else 'write'
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        cursor = self.connection().execute(sql, params)
+        self._record(self._kind(sql), started)
+        return cursor
+
+    def executemany(self, sql, rows):
+        started = time.perf_counter()
+        cursor = self.connection().executemany(sql, rows)
+        self._record('write', started)
+        return cursor
+
+    def query(self, sql, params=()):
+        # Timed including fetching every row
+        started = time.perf_counter()
+        rows = [dict(row) for row in self.connection().execute(sql, params)]
+        self._record('read', started)
+        return rows
+
+    def query_one(self, sql, params=()):
+        started = time.perf_counter()
+        row = self.connection().execute(sql, params).fetchone()
+        self._record('read', started)
+        return dict(row) if row else None
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+db = Database(DATABASE_PATH)
@@ -0,0 +1,254 @@
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
+
+from metrics import metrics
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling upstream while the circuit is open."""
+
+
+class UpstreamBusyError(Exception):
+    """Raised when a call waited too long for a free worker; says nothing
+    about upstream health, so it is neither retried nor counted by the breaker."""
+
+
+class BadRequestError(Exception):
+    """Raised by a fetch when the request itself is invalid (e.g. an unknown
+    sector); not retried and not counted by the breaker."""
+
+
+class CircuitBreaker:
+    """Stops calling a failing upstream for a while.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    every call is rejected for `reset_timeout` seconds. Then one trial call
+    is let through (half-open): success closes the circuit, failure opens
+    it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def release(self):
+        # A call that says nothing about upstream health: only frees the
+        # half-open trial slot it may have taken
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial = False
+
+
+class FetchPipeline:
+    """Runs upstream calls on a bounded thread pool.
+
+    At most `max_workers` calls run at once. Each attempt gets `timeout`
+    seconds from when a worker starts it; failed or timed-out attempts are
+    retried up to `retries` times with exponential backoff starting at
+    `backoff` seconds. All calls share one CircuitBreaker, so an outage fails
+    fast instead of tying up request threads. A timed-out call cannot be
+    interrupted and keeps its worker until it returns, which is what
+    eventually trips the breaker.
+
+    A call still queued for a worker after `queue_timeout` seconds fails
+    with UpstreamBusyError, and a fetch may raise BadRequestError for
+    invalid input; neither is retried or counted by the breaker, so load
+    and bad input alone never open the circuit.
+    """
+
+    def __init__(self, max_workers=8, timeout=5.0, retries=2, backoff=0.2, breaker=None, queue_timeout=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.queue_timeout = timeout if queue_timeout is None else queue_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.busy = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upstream')
+        self._lock = threading.Lock()
+
+    def call(self, operation, fetch, *args):
+        """Return fetch(*args), raising the last error once retries run out.
+
+        `operation` names the call in metrics, e.g. 'quotes'.
+        """
+        results, errors = self._run(operation, lambda _: fetch(*args), [None])
+        if None in errors:
+            raise errors[None]
+        return results[None]
+
+    def map(self, operation, fetch, keys):
+        """Call fetch(key) for every key concurrently.
+
+        Returns (results, errors): {key: value} for the calls that succeeded
+        and {key: exception} for the ones that did not.
+        """
+        return self._run(operation, fetch, list(dict.fromkeys(keys)))
+
+    @staticmethod
+    def _timed(operation, fetch, key, started_at):
+        # started_at receives the monotonic time the call left the queue
+        started_at.append(time.monotonic())
+        started = time.perf_counter()
+        try:
+            return fetch(key)
+        finally:
+            metrics.observe('upstream_call_duration_seconds', {'operation': operation},
+                            time.perf_counter() - started)
+
+    def _run(self, operation, fetch, keys):
+        started = time.perf_counter()
+        try:
+            return self._attempts(operation, fetch, keys)
+        finally:
+            # Time this request thread spent waiting on upstream
+            metrics.add_request('upstream', time.perf_counter() - started, len(keys))
+
+    def _attempts(self, operation, fetch, keys):
+        results = {}
+        errors = {}
+        pending = keys
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            allowed = []
+            for key in pending:
+                if self.breaker.allow():
+                    allowed.append(key)
+                else:
+                    errors[key] = CircuitOpenError('upstream circuit is open')
+                    metrics.inc('upstream_calls_total', {'operation': operation, 'outcome': 'rejected'})
+            if not allowed:
+                break
+
+            starts = {}
+            futures = {}
+            for key in allowed:
+                started_at = []
+                future = self._executor.submit(self._timed, operation, fetch, key, started_at)
+                futures[future], starts[future] = key, started_at
+            timed_out, busy = self._wait(futures, starts)
+
+            pending = []
+            for future, key in futures.items():
+                if future in busy:
+                    errors[key] = UpstreamBusyError('no upstream worker became free in time')
+                    metrics.inc('upstream_calls_total', {'operation': operation, 'outcome': 'busy'})
+                    self.breaker.release()
+                    with self._lock:
+                        self.busy += 1
+                    continue
+                if future not in timed_out and future.exception() is None:
+                    results[key] = future.result()
+                    errors.pop(key, None)
+                    self.breaker.record_success()
+                    metrics.inc('upstream_calls_total', {'operation': operation, 'outcome': 'success'})
+                    continue
+                if future not in timed_out and isinstance(future.exception(), BadRequestError):
+                    errors[key] = future.exception()
+                    metrics.inc('upstream_calls_total', {'operation': operation, 'outcome': 'bad_request'})
+                    self.breaker.release()
+                    continue
+                if future not in timed_out:
+                    errors[key] = future.exception()
+                    metrics.inc('upstream_calls_total', {'operation': operation, 'outcome': 'error'})
+                else:
+                    errors[key] = TimeoutError(f'upstream call timed out after {self.timeout}s')
+                    metrics.inc('upstream_calls_total', {'operation': operation, 'outcome': 'timeout'})
+                    with self._lock:
+                        self.timeouts += 1
+                self.breaker.record_failure()
+                pending.append(key)
+            with self._lock:
+                self.calls += len(futures)
+                self.failures += len(pending)
+            if not pending:
+                break
+        return results, errors
+
+    def _wait(self, futures, starts):
+        """Wait until every future is done, has run for `timeout` seconds, or
+        has sat in the queue for `queue_timeout`. Returns (timed_out, busy);
+        busy futures were cancelled before they started."""
+        submitted = time.monotonic()
+        timed_out, busy = set(), set()
+        waiting = set(futures)
+        while True:
+            now = time.monotonic()
+            deadlines = []
+            for future in list(waiting):
+                if future.done():
+                    waiting.discard(future)
+                elif starts[future]:
+                    if now - starts[future][0] >= self.timeout:
+                        timed_out.add(future)
+                        waiting.discard(future)
+                    else:
+                        deadlines.append(starts[future][0] + self.timeout)
+                elif now - submitted >= self.queue_timeout and future.cancel():
+                    busy.add(future)
+                    waiting.discard(future)
+                else:
+                    # Queued calls are re-checked often, so one that starts
+                    # running gets its full timeout from that moment
+                    deadlines.append(min(submitted + self.queue_timeout, now + 0.05))
+            if not waiting:
+                return timed_out, busy
+            wait(waiting, timeout=max(min(deadlines) - now, 0), return_when=FIRST_COMPLETED)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'upstream_calls': self.calls,
+                'upstream_failures': self.failures,
+                'upstream_timeouts': self.timeouts,
+                'upstream_busy': self.busy,
+                'circuit_state': self.breaker.state,
+                'circuit_rejected': self.breaker.rejected,
+            }
@@ -0,0 +1,106 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class GroupCommitWriter:
+    """Single writer thread that commits concurrent writes in groups.
+
+    Callers submit a function that performs its reads and writes through
+    the repository; the writer drains everything queued while the previous
+    commit was being flushed and runs it as one database transaction, so a
+    whole group costs one fsync of the write-ahead log. Each operation runs
+    in its own savepoint: if it raises, only its changes are rolled back and
+    the exception is re-raised in the caller.
+
+    While idle the writer checkpoints the log into the main database file
+    every `checkpoint_interval` seconds.
+    """
+
+    def __init__(self, database, max_batch=512, max_wait=0.0, checkpoint_interval=30):
+        self.database = database
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.checkpoint_interval = checkpoint_interval
+        self.batches = 0
+        self.writes = 0
+        self.checkpoints = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_checkpoint = time.monotonic()
+
+    def submit(self, operation):
+        # Blocks until the operation's group is durably committed
+        self._ensure_started()
+        future = Future()
+        self._queue.put((operation, future))
+        return future.result()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                timeout = deadline - time.monotonic()
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._commit(batch)
+            elif time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+                self.checkpoint()
+
+    def _commit(self, batch):
+        results = []
+        try:
+            with self.database.transaction():
+                for operation, _ in batch:
+                    try:
+                        with self.database.transaction():
+                            results.append((operation(), None))
+                    except Exception as exc:
+                        results.append((None, exc))
+        except Exception as exc:
+            # The commit itself failed: nothing in the group was written
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+
+        self.batches += 1
+        self.writes += len(batch)
+        for (_, future), (result, error) in zip(batch, results):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def checkpoint(self):
+        # Fold the write-ahead log into the main database file and truncate it
+        self.database.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.checkpoints += 1
+        self._last_checkpoint = time.monotonic()
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'writes': self.writes,
+            'avg_batch_size': self.writes / self.batches if self.batches else 0.0,
+            'checkpoints': self.checkpoints,
+            'queued': self._queue.qsize(),
+        }
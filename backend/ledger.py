@@ -0,0 +1,275 @@
+import logging
+import os
+from collections import defaultdict, deque
+
+from database import db
+from repository import now_iso
+
+# How the cost of sold shares is measured: 'average' cost or 'fifo' lots.
+# Lots are always consumed oldest first; the method only changes cost basis.
+COST_METHOD = os.environ.get('LEDGER_COST_METHOD', 'average')
+
+log = logging.getLogger('stocks.ledger')
+
+
+class LedgerError(Exception):
+    """The trade history cannot be applied to the ledger."""
+
+
+def _sold_cost(method, quantity, held, cost_basis, fifo_cost):
+    # Cost basis leaving the position when `quantity` of `held` shares are sold
+    if quantity == held:
+        return cost_basis
+    if method == 'fifo':
+        return fifo_cost
+    return cost_basis * quantity / held
+
+
+# Incremental updates, called inside the trade's database transaction
+
+def record_trade(uid, ticker, action, quantity, price, transaction_id=None, created_at=None, method=None):
+    method = method or COST_METHOD
+    created_at = created_at or now_iso()
+    with db.transaction():
+        position = db.query_one(
+            'SELECT * FROM ledger_positions WHERE uid = ? AND ticker = ?', (uid, ticker)
+        ) or {'quantity': 0, 'cost_basis': 0.0, 'realized_pnl': 0.0}
+        held = position['quantity']
+        cost_basis = position['cost_basis']
+        realized_pnl = position['realized_pnl']
+
+        if action == 'BUY':
+            db.execute(
+                'INSERT INTO ledger_lots (uid, ticker, transaction_id, quantity, price, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (uid, ticker, transaction_id, quantity, price, created_at),
+            )
+            held += quantity
+            cost_basis += price * quantity
+        elif action == 'SELL':
+            if quantity > held:
+                raise LedgerError(f"Selling {quantity} {ticker} but the ledger holds {held}")
+            removed = _sold_cost(method, quantity, held, cost_basis, _consume_lots(uid, ticker, quantity))
+            realized_pnl += price * quantity - removed
+            held -= quantity
+            cost_basis = cost_basis - removed if held else 0.0
+        else:
+            raise LedgerError(f"Unknown action: {action}")
+
+        db.execute(
+            'INSERT INTO ledger_positions (uid, ticker, quantity, cost_basis, realized_pnl, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (uid, ticker) DO UPDATE SET quantity = excluded.quantity, '
+            'cost_basis = excluded.cost_basis, realized_pnl = excluded.realized_pnl, '
+            'updated_at = excluded.updated_at',
+            (uid, ticker, held, cost_basis, realized_pnl, created_at),
+        )
+
+
+def _consume_lots(uid, ticker, quantity):
+    # Take shares from the oldest open lots; returns their total cost
+    cost = 0.0
+    while quantity > 0:
+        lot = db.query_one(
+            'SELECT id, quantity, price FROM ledger_lots WHERE uid = ? AND ticker = ? ORDER BY id LIMIT 1',
+            (uid, ticker),
+        )
+        if lot is None:
+            raise LedgerError(f"No open lots left for {ticker}")
+        taken = min(quantity, lot['quantity'])
+        cost += taken * lot['price']
+        quantity -= taken
+        if taken == lot['quantity']:
+            db.execute('DELETE FROM ledger_lots WHERE id = ?', (lot['id'],))
+        else:
+            db.execute('UPDATE ledger_lots SET quantity = ? WHERE id = ?', (lot['quantity'] - taken, lot['id']))
+    return cost
+
+
+# Reads: O(positions), no transaction replay
+
+def get_positions(uid):
+    rows = db.query('SELECT * FROM ledger_positions WHERE uid = ? ORDER BY ticker', (uid,))
+    for row in rows:
+        row['average_cost'] = row['cost_basis'] / row['quantity'] if row['quantity'] else 0.0
+    return {row['ticker']: row for row in rows}
+
+
+def get_lots(uid, ticker):
+    return db.query(
+        'SELECT * FROM ledger_lots WHERE uid = ? AND ticker = ? ORDER BY id', (uid, ticker)
+    )
+
+
+# Rebuilding from stock_transactions
+
+def _take_lots(open_lots, quantity):
+    # Remove `quantity` shares from the oldest open lots; returns their cost
+    cost = 0.0
+    while quantity:
+        lot = open_lots[0]
+        taken = min(quantity, lot[1])
+        cost += taken * lot[2]
+        quantity -= taken
+        lot[1] -= taken
+        if not lot[1]:
+            open_lots.popleft()
+    return cost
+
+
+def replay(transactions, method=None, adjustments=()):
+    """Recompute ledger state from transactions sorted by (uid, created_at, id).
+
+    `adjustments` are ledger_adjustments rows, merged into the history by
+    created_at (ahead of transactions with the same timestamp). Returns
+    ({(uid, ticker): position}, {(uid, ticker): [open lots]}).
+    """
+    method = method or COST_METHOD
+    positions = defaultdict(lambda: {'quantity': 0, 'cost_basis': 0.0, 'realized_pnl': 0.0})
+    lots = defaultdict(deque)
+    events = transactions
+    if adjustments:
+        events = sorted([dict(row, action='ADJUST') for row in adjustments] + list(transactions),
+                        key=lambda row: (row['uid'], row['created_at'], row['action'] != 'ADJUST', row['id']))
+    for tx in events:
+        key = (tx['uid'], tx['ticker'])
+        position = positions[key]
+        quantity, price = tx['quantity'], tx['price']
+        if tx['action'] == 'ADJUST' and quantity < 0:
+            # Shares the portfolio does not hold leave at cost, without P&L
+            quantity = min(-quantity, position['quantity'])
+            fifo_cost = _take_lots(lots[key], quantity)
+            if quantity:
+                position['cost_basis'] -= _sold_cost(method, quantity, position['quantity'],
+                                                     position['cost_basis'], fifo_cost)
+                position['quantity'] -= quantity
+            continue
+        if tx['action'] in ('BUY', 'ADJUST'):
+            transaction_id = tx['id'] if tx['action'] == 'BUY' else None
+            lots[key].append([transaction_id, quantity, price, tx['created_at']])
+            position['quantity'] += quantity
+            position['cost_basis'] += price * quantity
+            continue
+
+        if quantity > position['quantity']:
+            raise LedgerError(f"Transaction {tx['id']} sells {quantity} {tx['ticker']} "
+                              f"but only {position['quantity']} are held")
+        fifo_cost = _take_lots(lots[key], quantity)
+        removed = _sold_cost(method, quantity, position['quantity'], position['cost_basis'], fifo_cost)
+        position['realized_pnl'] += price * quantity - removed
+        position['quantity'] -= quantity
+        position['cost_basis'] = position['cost_basis'] - removed if position['quantity'] else 0.0
+    return dict(positions), {key: list(open_lots) for key, open_lots in lots.items() if open_lots}
+
+
+def reconcile(positions, holdings, transactions):
+    """Adjustments that bring replayed positions to the quantities held.
+
+    `holdings` ({(uid, ticker): quantity}) comes from the portfolio, which
+    trades are checked against, so it wins. Shares missing from the history
+    get an opening adjustment dated at the ticker's first transaction and
+    priced at the replayed average cost (or the last traded price); surplus
+    shares get a removal dated now. Returns new ledger_adjustments rows as
+    (uid, ticker, quantity, price, created_at).
+    """
+    last_price, first_seen = {}, {}
+    for tx in transactions:
+        key = (tx['uid'], tx['ticker'])
+        last_price[key] = tx['price']
+        first_seen.setdefault(key, tx['created_at'])
+
+    adjustments = []
+    for key in sorted(set(positions) | set(holdings)):
+        position = positions.get(key, {'quantity': 0, 'cost_basis': 0.0})
+        difference = holdings.get(key, 0) - position['quantity']
+        if difference > 0:
+            price = position['cost_basis'] / position['quantity'] if position['quantity'] \
+                else last_price.get(key, 0.0)
+            adjustments.append((key[0], key[1], difference, price, first_seen.get(key) or now_iso()))
+        elif difference < 0:
+            adjustments.append((key[0], key[1], difference, 0.0, now_iso()))
+    return adjustments
+
+
+def _transactions(uid=None):
+    if uid is None:
+        return db.query('SELECT * FROM stock_transactions ORDER BY uid, created_at, id')
+    return db.query('SELECT * FROM stock_transactions WHERE uid = ? ORDER BY created_at, id', (uid,))
+
+
+def _holdings(uid=None):
+    where, params = ('WHERE uid = ?', (uid,)) if uid is not None else ('', ())
+    return {(row['uid'], row['ticker']): row['total_quantity']
+            for row in db.query(f'SELECT uid, ticker, total_quantity FROM portfolio {where}', params)}
+
+
+def _adjustments(uid=None):
+    where, params = ('WHERE uid = ?', (uid,)) if uid is not None else ('', ())
+    return db.query(f'SELECT * FROM ledger_adjustments {where} ORDER BY uid, created_at, id', params)
+
+
+def _reconciled_replay(uid=None, method=None):
+    # Replay including stored adjustments, then any new adjustments needed
+    transactions, adjustments = _transactions(uid), _adjustments(uid)
+    positions, lots = replay(transactions, method, adjustments)
+    new = reconcile(positions, _holdings(uid), transactions)
+    if new:
+        adjustments = adjustments + [dict(zip(('uid', 'ticker', 'quantity', 'price', 'created_at'), row), id=0)
+                                     for row in new]
+        positions, lots = replay(transactions, method, adjustments)
+    return positions, lots, new
+
+
+def rebuild(uid=None, method=None):
+    # Replace the stored ledger (for one user or everyone) with a replay,
+    # first recording adjustments for portfolio quantities the transaction
+    # history does not explain
+    positions, lots, new = _reconciled_replay(uid, method)
+    for adjusted_uid, ticker, quantity, _, _ in new:
+        log.warning("ledger: uid %s %s adjusted by %+d shares to match the portfolio",
+                    adjusted_uid, ticker, quantity)
+    where, params = ('WHERE uid = ?', (uid,)) if uid is not None else ('', ())
+    with db.transaction():
+        db.execute(f'DELETE FROM ledger_positions {where}', params)
+        db.execute(f'DELETE FROM ledger_lots {where}', params)
+        db.executemany(
+            'INSERT INTO ledger_adjustments (uid, ticker, quantity, price, created_at) VALUES (?, ?, ?, ?, ?)', new
+        )
+        db.executemany(
+            'INSERT INTO ledger_positions (uid, ticker, quantity, cost_basis, realized_pnl, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(key[0], key[1], p['quantity'], p['cost_basis'], p['realized_pnl'], now_iso())
+             for key, p in positions.items()],
+        )
+        db.executemany(
+            'INSERT INTO ledger_lots (uid, ticker, transaction_id, quantity, price, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(key[0], key[1], lot[0], lot[1], lot[2], lot[3])
+             for key, open_lots in lots.items() for lot in open_lots],
+        )
+    return len(positions)
+
+
+def verify(uid=None, method=None, tolerance=1e-6):
+    """Compare the stored ledger with a replay reconciled to the portfolio,
+    and portfolio quantities with the stored ledger.
+
+    Returns a list of human-readable mismatches; empty means consistent.
+    """
+    expected, _, _ = _reconciled_replay(uid, method)
+    where, params = ('WHERE uid = ?', (uid,)) if uid is not None else ('', ())
+    stored = {(row['uid'], row['ticker']): row
+              for row in db.query(f'SELECT * FROM ledger_positions {where}', params)}
+    holdings = _holdings(uid)
+
+    mismatches = []
+    for key in sorted(set(expected) | set(stored) | set(holdings)):
+        want = expected.get(key, {'quantity': 0, 'cost_basis': 0.0, 'realized_pnl': 0.0})
+        have = stored.get(key, {'quantity': 0, 'cost_basis': 0.0, 'realized_pnl': 0.0})
+        for field in ('quantity', 'cost_basis', 'realized_pnl'):
+            if abs(want[field] - have[field]) > tolerance:
+                mismatches.append(f"uid {key[0]} {key[1]}: ledger {field} {have[field]} != replay {want[field]}")
+        if holdings.get(key, 0) != have['quantity']:
+            mismatches.append(f"uid {key[0]} {key[1]}: portfolio holds {holdings.get(key, 0)} "
+                              f"!= ledger {have['quantity']}")
+    return mismatches
@@ -0,0 +1,332 @@
+import math
+import random
+import time
+import zlib
+from datetime import date, timedelta
+
+import pandas as pd
+import yfinance as yf
+
+from fetch_pipeline import BadRequestError
+
+
+class MarketDataError(Exception):
+    """The upstream returned nothing usable, e.g. a network error or rate limit."""
+
+
+# Yahoo sector keys; anything else is a client error, not an upstream failure
+SECTORS = frozenset([
+    'basic-materials', 'communication-services', 'consumer-cyclical', 'consumer-defensive',
+    'energy', 'financial-services', 'healthcare', 'industrials', 'real-estate',
+    'technology', 'utilities',
+])
+
+
+# A quote is a plain dict: {'ticker', 'price', 'previous_close'}.
+# previous_close is None when the upstream only returned a single bar.
+class MarketDataProvider:
+    """Interface every market-data source implements."""
+
+    def get_quotes(self, tickers):
+        """Return {ticker: quote} for every ticker that could be resolved.
+
+        Implementations must resolve the whole list with as few upstream
+        round trips as possible; unknown tickers are simply left out. Raises
+        MarketDataError when the upstream returned nothing at all.
+        """
+        raise NotImplementedError
+
+    def get_info(self, ticker):
+        """Return company metadata: {'company_name', 'volume'}."""
+        raise NotImplementedError
+
+    def get_history(self, ticker, period='1mo'):
+        """Return daily closes as {'dates': [...], 'prices': [...]}."""
+        raise NotImplementedError
+
+    def get_sector_companies(self, sector):
+        """Return the tickers of the top companies in a sector.
+
+        Raises BadRequestError for a sector that is not in SECTORS.
+        """
+        raise NotImplementedError
+
+    def get_bars(self, tickers, start):
+        """Return daily OHLCV bars from `start` (a date) through today.
+
+        Result is {ticker: {'dates', 'open', 'high', 'low', 'close', 'volume'}}
+        with parallel lists; all tickers are fetched in one round trip.
+        """
+        raise NotImplementedError
+
+    def get_quote(self, ticker):
+        return self.get_quotes([ticker]).get(ticker)
+
+
+def _unique(tickers):
+    # Keep the first occurrence of every ticker, in request order
+    return list(dict.fromkeys(t for t in tickers if t))
+
+
+class YFinanceProvider(MarketDataProvider):
+    """Market data from Yahoo Finance; quotes come from one bulk download.
+
+    yf.download reports network errors and rate limits as an empty frame
+    rather than raising. When a download comes back empty, one known-good
+    `probe_symbol` is fetched: if that works the requested symbols are
+    simply unknown, otherwise the call failed and MarketDataError is raised.
+    """
+
+    def __init__(self, quote_period='5d', probe_symbol='SPY'):
+        # A few days of bars so the previous close is available even after
+        # weekends and holidays
+        self.quote_period = quote_period
+        self.probe_symbol = probe_symbol
+
+    def _check_reachable(self):
+        frame = yf.download(self.probe_symbol, period='5d', interval='1d', auto_adjust=True, progress=False)
+        if frame is None or frame.empty:
+            raise MarketDataError("Yahoo Finance returned no data, not even for the probe symbol")
+
+    def get_quotes(self, tickers):
+        tickers = _unique(tickers)
+        if not tickers:
+            return {}
+
+        frame = yf.download(
+            tickers,
+            period=self.quote_period,
+            interval='1d',
+            group_by='ticker',
+            auto_adjust=True,
+            threads=True,
+            progress=False,
+        )
+
+        quotes = {}
+        for ticker in tickers:
+            closes = self._closes(frame, ticker)
+            if closes is None or closes.empty:
+                continue
+            quotes[ticker] = {
+                'ticker': ticker,
+                'price': float(closes.iloc[-1]),
+                'previous_close': float(closes.iloc[-2]) if len(closes) > 1 else None,
+            }
+        if not quotes:
+            # Unknown symbols or a failed download
+            self._check_reachable()
+        return quotes
+
+    @staticmethod
+    def _closes(frame, ticker):
+        if frame is None or frame.empty:
+            return None
+        if isinstance(frame.columns, pd.MultiIndex):
+            if ticker not in frame.columns.get_level_values(0):
+                return None
+            return frame[ticker]['Close'].dropna()
+        return frame['Close'].dropna()
+
+    def get_info(self, ticker):
+        info = yf.Ticker(ticker).info
+        return {
+            'company_name': info.get('longName', 'N/A'),
+            'volume': info.get('volume', 'N/A'),
+        }
+
+    def get_history(self, ticker, period='1mo'):
+        history = yf.Ticker(ticker).history(period=period)
+        return {
+            'dates': history.index.strftime('%Y-%m-%d').tolist(),
+            'prices': history['Close'].round(2).tolist(),
+        }
+
+    def get_sector_companies(self, sector):
+        if sector not in SECTORS:
+            raise BadRequestError(f'unknown sector {sector!r}')
+        return yf.Sector(sector).top_companies.index.tolist()
+
+    def get_bars(self, tickers, start):
+        tickers = _unique(tickers)
+        if not tickers:
+            return {}
+        frame = yf.download(
+            tickers,
+            start=start.isoformat(),
+            interval='1d',
+            group_by='ticker',
+            auto_adjust=True,
+            threads=True,
+            progress=False,
+        )
+        if frame is None or frame.empty:
+            # Either there are no bars since `start` yet or the download failed
+            self._check_reachable()
+            return {}
+        bars = {}
+        for ticker in tickers:
+            if isinstance(frame.columns, pd.MultiIndex):
+                if ticker not in frame.columns.get_level_values(0):
+                    continue
+                ticker_frame = frame[ticker].dropna(subset=['Close'])
+            else:
+                ticker_frame = frame.dropna(subset=['Close'])
+            bars[ticker] = {
+                'dates': ticker_frame.index.strftime('%Y-%m-%d').tolist(),
+                'open': ticker_frame['Open'].tolist(),
+                'high': ticker_frame['High'].tolist(),
+                'low': ticker_frame['Low'].tolist(),
+                'close': ticker_frame['Close'].tolist(),
+                'volume': ticker_frame['Volume'].tolist(),
+            }
+        return bars
+
+
+FAKE_SECTORS = {
+    'technology': ['AAPL', 'MSFT', 'NVDA', 'AVGO', 'ORCL', 'CRM', 'ADBE', 'AMD', 'ACN', 'CSCO',
+                   'NOW', 'IBM', 'INTU', 'TXN', 'QCOM', 'ADI', 'PANW', 'LRCX', 'KLAC', 'PLTR'],
+    'healthcare': ['LLY', 'UNH', 'JNJ', 'ABBV', 'MRK', 'TMO', 'ABT', 'ISRG', 'DHR', 'AMGN'],
+    'financial-services': ['BRK-B', 'JPM', 'V', 'MA', 'BAC', 'WFC', 'GS', 'MS', 'SPGI', 'FI'],
+}
+
+
+class FakeMarketDataProvider(MarketDataProvider):
+    """Deterministic, in-process market data for tests and benchmarks.
+
+    Prices are derived from a hash of the ticker, so every run sees the same
+    numbers without touching the network. `latency` (seconds) simulates the
+    cost of one upstream round trip and `calls` counts them. `set_price()`
+    moves a ticker's price, e.g. to exercise live quote updates.
+    """
+
+    def __init__(self, latency=0.0, sectors=None):
+        self.latency = latency
+        self.sectors = sectors if sectors is not None else FAKE_SECTORS
+        self.calls = 0
+        self.prices = {}  # ticker -> price set with set_price()
+
+    @staticmethod
+    def is_known(ticker):
+        # Anything that looks like a listed symbol resolves
+        return bool(ticker) and ticker.replace('-', '').replace('.', '').isalpha() \
+            and ticker.isupper() and len(ticker) <= 10
+
+    @staticmethod
+    def _seed(ticker):
+        return zlib.crc32(ticker.encode('utf-8'))
+
+    def _round_trip(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _opening_price(self, ticker):
+        seed = self._seed(ticker)
+        return round(20 + seed % 480 + (seed >> 12) % 100 / 100, 2)
+
+    def _price(self, ticker):
+        return self.prices.get(ticker, self._opening_price(ticker))
+
+    def _previous_close(self, ticker):
+        seed = self._seed(ticker)
+        change = ((seed >> 8) % 401 - 200) / 10000
+        return round(self._opening_price(ticker) / (1 + change), 2)
+
+    def set_price(self, ticker, price):
+        self.prices[ticker] = price
+
+    def get_quotes(self, tickers):
+        tickers = _unique(tickers)
+        if not tickers:
+            return {}
+        self._round_trip()
+        return {
+            ticker: {
+                'ticker': ticker,
+                'price': self._price(ticker),
+                'previous_close': self._previous_close(ticker),
+            }
+            for ticker in tickers if self.is_known(ticker)
+        }
+
+    def get_info(self, ticker):
+        self._round_trip()
+        if not self.is_known(ticker):
+            return {'company_name': 'N/A', 'volume': 'N/A'}
+        return {
+            'company_name': f'{ticker} Corporation',
+            'volume': 100000 + self._seed(ticker) % 50000000,
+        }
+
+    def get_history(self, ticker, period='1mo'):
+        self._round_trip()
+        if not self.is_known(ticker):
+            return {'dates': [], 'prices': []}
+        days = {'5d': 5, '1mo': 21, '3mo': 63, '6mo': 126, '1y': 252}.get(period, 21)
+
+        # Random walk that ends on the current fake price
+        rng = random.Random(self._seed(ticker))
+        prices = [self._price(ticker)]
+        for _ in range(days - 1):
+            prices.append(round(prices[-1] / (1 + rng.uniform(-0.02, 0.02)), 2))
+        prices.reverse()
+
+        dates = []
+        day = date.today()
+        while len(dates) < days:
+            if day.weekday() < 5:
+                dates.append(day.isoformat())
+            day -= timedelta(days=1)
+        dates.reverse()
+        return {'dates': dates, 'prices': prices}
+
+    def get_sector_companies(self, sector):
+        if sector not in SECTORS:
+            raise BadRequestError(f'unknown sector {sector!r}')
+        self._round_trip()
+        return list(self.sectors.get(sector, []))
+
+    def get_bars(self, tickers, start):
+        tickers = _unique(tickers)
+        if not tickers:
+            return {}
+        self._round_trip()
+        days = []
+        day = start
+        while day <= date.today():
+            if day.weekday() < 5:
+                days.append(day)
+            day += timedelta(days=1)
+
+        bars = {}
+        for ticker in tickers:
+            if not self.is_known(ticker):
+                continue
+            seed = self._seed(ticker)
+            price = self._price(ticker)
+            # Smooth deterministic wave, so bars fetched at different times agree
+            closes = [round(price * (1 + 0.05 * math.sin(d.toordinal() / 6 + seed % 97)), 2) for d in days]
+            opens = [round(close * (1 - 0.004 * math.cos(d.toordinal() + seed % 13)), 2)
+                     for close, d in zip(closes, days)]
+            bars[ticker] = {
+                'dates': [d.isoformat() for d in days],
+                'open': opens,
+                'high': [round(max(o, c) * 1.01, 2) for o, c in zip(opens, closes)],
+                'low': [round(min(o, c) * 0.99, 2) for o, c in zip(opens, closes)],
+                'close': closes,
+                'volume': [float(100000 + (seed + d.toordinal()) % 5000000) for d in days],
+            }
+        return bars
+
+
+PROVIDERS = {
+    'yfinance': YFinanceProvider,
+    'fake': FakeMarketDataProvider,
+}
+
+
+def create_provider(name):
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown market data provider: {name}")
+    return PROVIDERS[name]()
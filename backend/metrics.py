@@ -0,0 +1,116 @@
+import bisect
+import threading
+
+# In-process metrics rendered in the Prometheus text exposition format.
+# Histograms and counters are global; the request-scoped totals (upstream
+# and DB time spent on behalf of the current request thread) feed the
+# per-request log line.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+HELP = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by route', DEFAULT_BUCKETS),
+    'upstream_call_duration_seconds': ('histogram', 'Market data upstream call latency', DEFAULT_BUCKETS),
+    'upstream_calls_total': ('counter', 'Market data upstream calls by outcome', None),
+    'db_statement_duration_seconds': ('histogram', 'SQLite statement and commit latency', DB_BUCKETS),
+}
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self):
+        self._histograms = {}  # name -> {labels: _Histogram}
+        self._counters = {}  # name -> {labels: value}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, name, labels, value):
+        labels = tuple(labels.items())
+        buckets = HELP.get(name, (None, None, DEFAULT_BUCKETS))[2]
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        labels = tuple(labels.items())
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + amount
+
+    # Request-scoped totals, kept per thread
+
+    def begin_request(self):
+        self._local.totals = {'upstream_calls': 0, 'upstream_seconds': 0.0, 'db_queries': 0, 'db_seconds': 0.0}
+
+    def add_request(self, kind, seconds, count=1):
+        # kind is 'upstream' or 'db'; ignored outside a request
+        totals = getattr(self._local, 'totals', None)
+        if totals is not None:
+            totals[f'{kind}_calls' if kind == 'upstream' else 'db_queries'] += count
+            totals[f'{kind}_seconds'] += seconds
+
+    def end_request(self):
+        totals = getattr(self._local, 'totals', None)
+        self._local.totals = None
+        return totals or {'upstream_calls': 0, 'upstream_seconds': 0.0, 'db_queries': 0, 'db_seconds': 0.0}
+
+    def render(self, gauges=()):
+        """Prometheus text for every metric plus `gauges`, an iterable of
+        (name, help, {labels}, value) sampled by the caller."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f'# HELP {name} {HELP.get(name, (None, name))[1]}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        bucket_labels = _format_labels(labels + (('le', bound),))
+                        lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+            for name, series in sorted(self._counters.items()):
+                lines.append(f'# HELP {name} {HELP.get(name, (None, name))[1]}')
+                lines.append(f'# TYPE {name} counter')
+                for labels, value in series.items():
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        described = set()
+        for name, help_text, labels, value in gauges:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name}{_format_labels(tuple(labels.items()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,111 @@
+"""Import a TinyDB stocks.json into the SQLite database.
+
+Usage: python migrate_tinydb.py [stocks.json] [--database stocks.db]
+
+Document ids are kept as primary keys, so re-running the import is safe:
+existing rows are replaced rather than duplicated. The per-user transaction
+counts, asset history series and position ledger are brought up to date
+in the same transaction.
+"""
+import argparse
+import json
+import logging
+import os
+
+import asset_series
+import ledger
+from database import db
+from user_cache import user_cache
+
+log = logging.getLogger('stocks.migrate')
+
+
+def load_tinydb(path):
+    with open(path) as f:
+        data = json.load(f)
+    # TinyDB stores each table as {doc_id: document}
+    return {
+        table: sorted(((int(doc_id), doc) for doc_id, doc in docs.items()), key=lambda item: item[0])
+        for table, docs in data.items()
+    }
+
+
+def migrate(tinydb_path, database):
+    tables = load_tinydb(tinydb_path)
+    counts = {}
+    with database.transaction():
+        users = tables.get('users', [])
+        database.executemany(
+            'INSERT OR REPLACE INTO users (id, username, password, balance, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(doc_id, doc['username'], doc['password'], doc.get('balance', 0),
+              doc.get('created_at', ''), doc.get('updated_at')) for doc_id, doc in users],
+        )
+        database.executemany(
+            'INSERT OR REPLACE INTO watchlist (uid, ticker, position) VALUES (?, ?, ?)',
+            [(doc_id, ticker, position) for doc_id, doc in users
+             for position, ticker in enumerate(doc.get('watchlist', []))],
+        )
+        database.after_commit(user_cache.clear)
+        counts['users'] = len(users)
+
+        transactions = tables.get('stock_transactions', [])
+        # An upsert rather than INSERT OR REPLACE: the rows REPLACE deletes do
+        # not fire the delete trigger, so re-imports inflated transaction_counts
+        database.executemany(
+            'INSERT INTO stock_transactions (id, uid, ticker, action, quantity, price, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET uid = excluded.uid, ticker = excluded.ticker, '
+            'action = excluded.action, quantity = excluded.quantity, price = excluded.price, '
+            'created_at = excluded.created_at',
+            [(doc_id, doc['uid'], doc['ticker'], doc['action'], doc['quantity'], doc['price'],
+              doc['created_at']) for doc_id, doc in transactions],
+        )
+        counts['stock_transactions'] = len(transactions)
+
+        positions = tables.get('portfolio', [])
+        database.executemany(
+            'INSERT OR REPLACE INTO portfolio (id, uid, ticker, total_quantity, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(doc_id, doc['uid'], doc['ticker'], doc['total_quantity'], doc['created_at'],
+              doc.get('updated_at')) for doc_id, doc in positions],
+        )
+        counts['portfolio'] = len(positions)
+
+        history = tables.get('history_asset', [])
+        database.executemany(
+            'INSERT OR REPLACE INTO history_asset (id, uid, total_value, date) VALUES (?, ?, ?, ?)',
+            [(doc_id, doc['uid'], doc['total_value'], doc['date']) for doc_id, doc in history],
+        )
+        counts['history_asset'] = len(history)
+
+        # Counts are recomputed outright in case a row changed owner
+        database.execute('DELETE FROM transaction_counts')
+        database.execute('INSERT INTO transaction_counts (uid, count) '
+                         'SELECT uid, COUNT(*) FROM stock_transactions GROUP BY uid')
+        # The series and ledger modules work on the shared connection
+        if database is db:
+            asset_series.rebuild()
+            try:
+                counts['ledger_positions'] = ledger.rebuild()
+            except ledger.LedgerError as e:
+                log.warning("Could not rebuild the position ledger: %s", e)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a TinyDB JSON file into SQLite')
+    parser.add_argument('source', nargs='?', default='stocks.json')
+    parser.add_argument('--database', default=os.environ.get('DATABASE_PATH', 'stocks.db'))
+    args = parser.parse_args()
+
+    # Point the shared database at the target before anything connects
+    db.path = args.database
+    db.init_schema()
+    counts = migrate(args.source, db)
+    for table, count in counts.items():
+        print(f'{table}: {count} rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
-from database import stock_transactions, portfolio_table, users_table
-from tinydb import Query
+import repository
+from user_cache import user_cache
 
 db = SQLAlchemy()
 
@@ -41,38 +41,36 @@ class User(db.Model):
 
 # User functions
 
-# Add a new user to the TinyDB
-def add_user(username, password, email):
+# Add a new user to the database
+def add_user(username, password, balance=0):
     # Check if the user already exists
-    if users_table.get(Query().username == username):
+    if repository.get_user_by_username(username):
         return {"error": "User already exists!"}
     
     # Insert new user with hashed password
-    users_table.insert({
-        'username': username,
-        'password': password,
-        'email': email,
-        'created_at': datetime.utcnow().isoformat()
-    })
+    repository.create_user(username, password, balance)
     return {"message": "User created successfully!"}
 
-# Cache to store user data
-user_cache = {}
+# Retrieve user from the bounded user cache or the database; the cache is
+# invalidated whenever a users row changes
+def find_user_by_username(username):
+    user = user_cache.get_by_username(username)
+    if user is None:
+        generation = user_cache.generation()
+        user = repository.get_user_by_username(username)
+        if user:
+            user_cache.put(user, generation)
+    return user
 
-# Retrieve user from cache or database
-def find_user_by_username(username):# Check if user is in cache
-    if username in user_cache:
-        return user_cache[username]
-    
-    # If not in cache, retrieve from database
-    user = users_table.get(Query().username == username)
-    
-    # Store in cache if found
-    if user:
-        user_cache[username] = user
-    
+def find_user_by_id(uid):
+    user = user_cache.get_by_id(uid)
+    if user is None:
+        generation = user_cache.generation()
+        user = repository.get_user(uid)
+        if user:
+            user_cache.put(user, generation)
     return user
 
 # List all users (for admin purposes, if needed)
 def list_all_users():
-    return users_table.all()
\ No newline at end of file
+    return repository.list_users()
\ No newline at end of file
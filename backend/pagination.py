@@ -0,0 +1,28 @@
+import base64
+import binascii
+import json
+
+
+# Opaque cursor tokens for keyset pagination: the sort key of the last row
+# on a page, as URL-safe base64 JSON
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    # An empty token starts from the first row
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+
+def paginate(rows, per_page, cursor_key):
+    # rows holds up to per_page + 1 rows; the extra one signals a next page
+    page_rows = rows[:per_page]
+    next_cursor = encode_cursor(cursor_key(page_rows[-1])) if len(rows) > per_page else None
+    return page_rows, next_cursor
@@ -0,0 +1,99 @@
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+
+class HasherBusy(Exception):
+    """Raised when too many hash operations are already queued."""
+
+
+# Run in the worker processes; hashes are the same format flask_bcrypt writes
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(pw_hash, password):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash
+        return False
+
+
+class PasswordHasher:
+    """Runs bcrypt in a process pool, off the request threads.
+
+    At most `max_pending` hash/check calls may be queued or running; beyond
+    that calls fail fast with HasherBusy. With `workers=0` hashing runs
+    inline, which is handy for scripts. Login attempts are counted for a
+    per-minute login rate.
+    """
+
+    def __init__(self, workers=2, max_pending=16, rounds=12):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.pending = 0
+        self.rejected = 0
+        self.logins = {'success': 0, 'invalid_password': 0, 'unknown_user': 0, 'rejected': 0}
+        self._recent_logins = deque()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Fork the workers up front, before request threads exist; fork
+        # (rather than spawn) keeps them from re-importing the app module
+        with self._lock:
+            if self.workers and self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+                for future in [self._executor.submit(_check, '', '') for _ in range(self.workers)]:
+                    future.result()
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        self.start()
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HasherBusy('password hashing queue is full')
+            self.pending += 1
+        try:
+            return self._executor.submit(function, *args).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        return self._run(_check, pw_hash, password)
+
+    def record_login(self, outcome):
+        # outcome is one of the keys of self.logins
+        now = time.monotonic()
+        with self._lock:
+            self.logins[outcome] += 1
+            self._recent_logins.append(now)
+            while self._recent_logins and self._recent_logins[0] <= now - 60:
+                self._recent_logins.popleft()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._recent_logins and self._recent_logins[0] <= now - 60:
+                self._recent_logins.popleft()
+            return {
+                'workers': self.workers,
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'rejected': self.rejected,
+                'logins': dict(self.logins),
+                'logins_per_minute': len(self._recent_logins),
+            }
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+# One .npy file per ticker holding a structured array of daily bars, read
+# memory-mapped. An update refetches from the last stored day, so that day's
+# bar (possibly a partial intraday one) is replaced by the final one, appends
+# anything newer and rewrites the file atomically.
+BAR_DTYPE = np.dtype([
+    ('day', '<i4'),  # days since 1970-01-01
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+])
+
+# Calendar days covered by each chart period
+PERIOD_DAYS = {'5d': 7, '1mo': 31, '3mo': 92, '6mo': 183, '1y': 366, '2y': 731, '5y': 1827}
+
+EPOCH = date(1970, 1, 1)
+
+
+class PriceHistoryStore:
+    """Local daily OHLCV store, filled incrementally from a market data provider.
+
+    A ticker is checked against upstream at most every `refresh_interval`
+    seconds, for bars from the last stored day on; the first fetch backfills
+    `initial_days` of history.
+    """
+
+    def __init__(self, provider, directory, refresh_interval=3600, initial_days=366):
+        self.provider = provider
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.initial_days = initial_days
+        self.upstream_fetches = 0
+        self._checked = {}  # ticker -> monotonic time of the last successful upstream check
+        self._fetching = set()  # tickers with an upstream call in progress
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, ticker):
+        return os.path.join(self.directory, f'{ticker.replace("/", "_")}.npy')
+
+    def load(self, ticker):
+        path = self._path(ticker)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=BAR_DTYPE)
+        return np.load(path, mmap_mode='r')
+
+    def _save(self, ticker, bars):
+        path = self._path(ticker)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, bars)
+        os.replace(tmp_path, path)
+
+    def update(self, tickers):
+        """Fetch bars from the last stored day on for every ticker that is
+        due, in a single upstream call. Returns the number of new bars stored;
+        the last stored bar is overwritten when upstream has changed it.
+
+        A ticker only counts as checked once its fetch succeeded, so a failed
+        call is retried; the upstream call runs without holding the lock.
+        """
+        now = time.monotonic()
+        today = (date.today() - EPOCH).days
+        with self._lock:
+            due = {}
+            for ticker in dict.fromkeys(tickers):
+                if ticker in self._fetching or \
+                        now - self._checked.get(ticker, float('-inf')) < self.refresh_interval:
+                    continue
+                stored = self.load(ticker)
+                last_day = int(stored['day'][-1]) if len(stored) else today - self.initial_days
+                if last_day <= today:
+                    due[ticker] = (stored, last_day)
+                else:
+                    self._checked[ticker] = now
+            if not due:
+                return 0
+            self._fetching.update(due)
+
+        try:
+            start = EPOCH + timedelta(days=min(last_day for _, last_day in due.values()))
+            fetched = self.provider.get_bars(list(due), start)
+            with self._lock:
+                self.upstream_fetches += 1
+                added = 0
+                for ticker, (stored, last_day) in due.items():
+                    new_bars = self._to_array(fetched.get(ticker))
+                    new_bars = new_bars[new_bars['day'] >= last_day]
+                    # Bars before last_day are kept; from last_day on, upstream wins
+                    kept = np.asarray(stored)[:np.searchsorted(stored['day'], last_day)]
+                    if len(new_bars) and not np.array_equal(new_bars, np.asarray(stored)[len(kept):]):
+                        self._save(ticker, np.concatenate([kept, new_bars]))
+                        added += int(np.count_nonzero(new_bars['day'] > last_day))
+                    # A ticker that still has no bars at all is asked for again next time
+                    if len(new_bars) or len(stored):
+                        self._checked[ticker] = now
+                return added
+        finally:
+            with self._lock:
+                self._fetching.difference_update(due)
+
+    @staticmethod
+    def _to_array(bars):
+        if not bars or not bars['dates']:
+            return np.empty(0, dtype=BAR_DTYPE)
+        array = np.empty(len(bars['dates']), dtype=BAR_DTYPE)
+        array['day'] = [(date.fromisoformat(d) - EPOCH).days for d in bars['dates']]
+        for field in ('open', 'high', 'low', 'close', 'volume'):
+            array[field] = bars[field]
+        return array[~np.isnan(array['close'])]
+
+    def get_histories(self, tickers, period='1mo'):
+        """Return {ticker: {'dates', 'prices'}} of daily closes over `period`,
+        read from disk after one batched incremental update."""
+        self.update(tickers)
+        since = (date.today() - EPOCH).days - PERIOD_DAYS.get(period, 31)
+        histories = {}
+        for ticker in dict.fromkeys(tickers):
+            bars = self.load(ticker)
+            bars = bars[np.searchsorted(bars['day'], since, side='right'):]
+            histories[ticker] = {
+                'dates': [(EPOCH + timedelta(days=int(day))).isoformat() for day in bars['day']],
+                'prices': np.round(bars['close'], 2).tolist(),
+            }
+        return histories
+
+    def get_history(self, ticker, period='1mo'):
+        return self.get_histories([ticker], period)[ticker]
@@ -0,0 +1,57 @@
+import logging
+import threading
+
+log = logging.getLogger('stocks.price_refresher')
+
+
+class PriceRefresher:
+    """Background thread that keeps quotes for hot tickers warm.
+
+    Every `interval` seconds it asks `tracked_tickers()` which tickers are
+    referenced by portfolios and watchlists and re-fetches their quotes in
+    batches of `batch_size`, so request handlers read from a warm cache.
+    """
+
+    def __init__(self, market_data, tracked_tickers, interval=15, batch_size=100):
+        self.market_data = market_data
+        self.tracked_tickers = tracked_tickers
+        self.interval = interval
+        self.batch_size = batch_size
+        self.runs = 0
+        self.last_refreshed = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def refresh_once(self):
+        tickers = sorted(set(self.tracked_tickers()))
+        refreshed = 0
+        for start in range(0, len(tickers), self.batch_size):
+            batch = tickers[start:start + self.batch_size]
+            refreshed += len(self.market_data.refresh_quotes(batch))
+        self.runs += 1
+        self.last_refreshed = refreshed
+        return refreshed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh_once()
+            except Exception:
+                # Keep refreshing on the next tick; requests fall back to lazy fetches
+                log.exception("price refresh failed")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        # Safe to call on every request: only the first call starts the thread
+        with self._lock:
+            if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='price-refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
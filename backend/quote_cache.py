@@ -0,0 +1,324 @@
+import logging
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from fetch_pipeline import BadRequestError, FetchPipeline
+from market_data import MarketDataProvider
+from singleflight import SingleFlight
+
+
+log = logging.getLogger('stocks.market_data')
+
+# Default time-to-live in seconds for each class of cached field
+DEFAULT_TTLS = {
+    'quote': 15,            # last close / previous close
+    'history': 60 * 60,     # 1-month close series
+    'info': 6 * 60 * 60,    # long name, volume
+    'sector': 24 * 60 * 60,  # sector constituents
+    'unknown': 60 * 60,      # negative entries for symbols upstream does not know
+}
+
+# Cached in place of a quote for a symbol upstream returned nothing for
+UNKNOWN = object()
+
+# Served by get_info() when metadata is neither cached nor fetchable
+MISSING_INFO = {'company_name': 'N/A', 'volume': 'N/A'}
+
+
+def _estimate_size(value):
+    # Rough deep size of the plain dicts/lists/scalars we store
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_estimate_size(k) + _estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_estimate_size(v) for v in value)
+    return size
+
+
+class QuoteCache:
+    """Memory-bounded LRU cache of resolved market data values.
+
+    Every key (usually a ticker) holds one value per field class, each with
+    its own expiry. When the estimated size exceeds `max_bytes` the least
+    recently used keys are evicted. Expired values are kept for `max_stale`
+    more seconds so callers can serve them while a refresh runs.
+    """
+
+    def __init__(self, ttls=None, max_bytes=32 * 1024 * 1024, max_stale=300, clock=time.monotonic):
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_bytes = max_bytes
+        self.max_stale = max_stale
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # key -> {field_class: (value, expires_at, size)}
+        self._lock = threading.Lock()
+
+    def get(self, key, field_class):
+        with self._lock:
+            fields = self._entries.get(key)
+            cached = fields.get(field_class) if fields else None
+            if cached is None or cached[1] <= self.clock():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+
+    def get_stale(self, key, field_class, max_stale=None):
+        # Expired value that is still inside the stale window, or None
+        max_stale = self.max_stale if max_stale is None else max_stale
+        with self._lock:
+            fields = self._entries.get(key)
+            cached = fields.get(field_class) if fields else None
+            if cached is None or cached[1] + max_stale <= self.clock():
+                return None
+            self._entries.move_to_end(key)
+            self.stale_hits += 1
+            return cached[0]
+
+    def peek(self, key, field_class):
+        # Cached value of any age, without touching LRU order or counters
+        with self._lock:
+            fields = self._entries.get(key)
+            cached = fields.get(field_class) if fields else None
+            return cached[0] if cached else None
+
+    def set(self, key, field_class, value, ttl=None):
+        # A field class may carry a qualifier, e.g. 'history:1mo'
+        ttl = self.ttls[field_class.split(':')[0]] if ttl is None else ttl
+        size = _estimate_size(value)
+        expires_at = self.clock() + ttl
+        with self._lock:
+            fields = self._entries.setdefault(key, {})
+            if field_class in fields:
+                self.current_bytes -= fields[field_class][2]
+            fields[field_class] = (value, expires_at, size)
+            self.current_bytes += size
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        # Never evict the entry that was just written
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, fields = self._entries.popitem(last=False)
+            self.current_bytes -= sum(cached[2] for cached in fields.values())
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class CachedMarketDataProvider(MarketDataProvider):
+    """Serves market data from a QuoteCache, going upstream only on misses.
+
+    Concurrent misses for the same value share a single upstream fetch, and
+    every upstream call runs on a FetchPipeline (bounded concurrency,
+    timeouts, retries, circuit breaker). When upstream fails, the last
+    cached value of any age is served instead. Expired quotes still inside
+    the cache's stale window are returned as-is and refreshed in the
+    background (stale-while-revalidate). With a `history_store`, chart
+    history is read from local disk instead of being fetched upstream.
+    Functions registered with add_quote_listener() are called with
+    {ticker: quote} after every upstream quote fetch.
+    """
+
+    def __init__(self, provider, cache=None, history_store=None, pipeline=None):
+        self.provider = provider
+        self.cache = cache if cache is not None else QuoteCache()
+        self.history_store = history_store
+        self.pipeline = pipeline if pipeline is not None else FetchPipeline()
+        self.flight = SingleFlight()
+        self.fallbacks = 0
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='quote-refresh')
+        self._pending_refresh = set()
+        self._pending_lock = threading.Lock()
+        self._quote_listeners = []
+
+    def add_quote_listener(self, listener):
+        self._quote_listeners.append(listener)
+
+    def _cached(self, keys, field_class):
+        # Split keys into ({key: fresh cached value}, [keys to fetch])
+        values = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            value = self.cache.get(key, field_class)
+            if value is None:
+                missing.append(key)
+            else:
+                values[key] = value
+        return values, missing
+
+    def _fetch_many(self, field_class, keys, fetch, listeners=()):
+        """Resolve keys with fetch(keys) -> (values, errors) and cache the values.
+
+        `listeners` are called with the fetched values once they are cached.
+        Keys that failed upstream get their last cached value, however old;
+        keys rejected with BadRequestError are just left out.
+        """
+        def fetch_and_store(flight_keys):
+            keys = [key for _, key in flight_keys]
+            try:
+                fetched, errors = fetch(keys)
+            except Exception as exc:
+                fetched, errors = {}, {key: exc for key in keys}
+            for key, value in fetched.items():
+                self.cache.set(key, field_class, value)
+            for listener in listeners:
+                try:
+                    listener(dict(fetched))
+                except Exception:
+                    log.exception("quote listener failed")
+            # Invalid keys (e.g. an unknown sector) have nothing to fall back to
+            errors = {key: exc for key, exc in errors.items() if not isinstance(exc, BadRequestError)}
+            if errors:
+                log.warning("upstream %s fetch failed for %d key(s): %r; serving cached values",
+                            field_class, len(errors), next(iter(errors.values())))
+                for key in errors:
+                    value = self.cache.get_stale(key, field_class, max_stale=math.inf)
+                    if value is not None:
+                        fetched[key] = value
+                        self.fallbacks += 1
+            return {(field_class, key): value for key, value in fetched.items()}
+
+        fetched = self.flight.do_many([(field_class, key) for key in keys], fetch_and_store)
+        return {key: value for (_, key), value in fetched.items()}
+
+    def get_many(self, tickers):
+        """Return quotes as a list in request order, None for unknown symbols."""
+        quotes = self.get_quotes(tickers)
+        return [quotes.get(ticker) for ticker in tickers]
+
+    def get_quotes(self, tickers, allow_stale=True):
+        """Return {ticker: quote} in request order, leaving out unknown tickers.
+
+        With allow_stale=False only quotes within their TTL are returned, never
+        stale or fallback ones, so a price can be acted on (e.g. to fill a trade).
+        """
+        tickers = [ticker for ticker in dict.fromkeys(tickers) if ticker]
+        quotes, missing = self._cached(tickers, 'quote')
+        stale = []
+        for ticker in (list(missing) if allow_stale else ()):
+            quote = self.cache.get_stale(ticker, 'quote')
+            if quote is not None:
+                quotes[ticker] = quote
+                stale.append(ticker)
+                missing.remove(ticker)
+
+        if stale:
+            self.refresh_quotes_async(stale)
+
+        # All misses are resolved with a single upstream batch, minus the
+        # tickers another thread is already fetching
+        if missing:
+            fetched = self._fetch_many('quote', missing, self._fetch_quotes, self._quote_listeners)
+            if not allow_stale:
+                # Fallback values are never written back, so a fetched quote
+                # is fresh exactly when the cache holds it as fresh
+                fetched = {ticker: quote for ticker, quote in fetched.items()
+                           if self.cache.get(ticker, 'quote') is not None}
+            quotes.update(fetched)
+        # Request order, without negative entries
+        return {ticker: quotes[ticker] for ticker in tickers
+                if quotes.get(ticker) is not None and quotes[ticker] is not UNKNOWN}
+
+    def get_quote(self, ticker, allow_stale=True):
+        return self.get_quotes([ticker], allow_stale).get(ticker)
+
+    def is_unknown(self, ticker):
+        # True when upstream recently reported that the symbol does not exist
+        return self.cache.peek(ticker, 'quote') is UNKNOWN
+
+    def refresh_quotes(self, tickers):
+        # Fetch fresh quotes regardless of what is cached
+        fetched = self._fetch_many('quote', tickers, self._fetch_quotes, self._quote_listeners)
+        return {ticker: quote for ticker, quote in fetched.items() if quote is not UNKNOWN}
+
+    def refresh_quotes_async(self, tickers):
+        with self._pending_lock:
+            tickers = [ticker for ticker in tickers if ticker not in self._pending_refresh]
+            self._pending_refresh.update(tickers)
+        if tickers:
+            self._refresher.submit(self._refresh_pending, tickers)
+
+    def _refresh_pending(self, tickers):
+        try:
+            self.refresh_quotes(tickers)
+        finally:
+            with self._pending_lock:
+                self._pending_refresh.difference_update(tickers)
+
+    def _fetch_quotes(self, tickers):
+        fetched = self.pipeline.call('quotes', self.provider.get_quotes, tickers)
+        errors = {}
+        for ticker in tickers:
+            if ticker in fetched:
+                continue
+            cached = self.cache.peek(ticker, 'quote')
+            if cached is None or cached is UNKNOWN:
+                # Remember symbols upstream does not know so typos are not looked up again
+                self.cache.set(ticker, 'quote', UNKNOWN, ttl=self.cache.ttls['unknown'])
+            else:
+                # A symbol we have quoted before: treat it as a failed fetch and
+                # keep serving the cached quote rather than forgetting it
+                errors[ticker] = LookupError(f"{ticker} missing from upstream batch")
+        return fetched, errors
+
+    def get_infos(self, tickers):
+        # Metadata has no bulk endpoint: misses are fetched concurrently
+        infos, missing = self._cached(tickers, 'info')
+        if missing:
+            infos.update(self._fetch_many(
+                'info', missing, lambda keys: self.pipeline.map('info', self.provider.get_info, keys)))
+        return infos
+
+    def get_info(self, ticker):
+        return self.get_infos([ticker]).get(ticker) or dict(MISSING_INFO)
+
+    def get_history(self, ticker, period='1mo'):
+        return self.get_histories([ticker], period).get(ticker)
+
+    def get_histories(self, tickers, period='1mo'):
+        field_class = f'history:{period}'
+        histories, missing = self._cached(tickers, field_class)
+        if missing:
+            def fetch(keys):
+                if self.history_store is not None:
+                    return self.pipeline.call('history', self.history_store.get_histories, keys, period), {}
+                return self.pipeline.map('history', lambda ticker: self.provider.get_history(ticker, period), keys)
+            histories.update(self._fetch_many(field_class, missing, fetch))
+        return histories
+
+    def get_sector_companies(self, sector):
+        companies, missing = self._cached([sector], 'sector')
+        if missing:
+            companies = self._fetch_many(
+                'sector', missing, lambda keys: self.pipeline.map('sector', self.provider.get_sector_companies, keys))
+        return list(companies.get(sector, []))
+
+    def stats(self):
+        return dict(self.cache.stats(), fallbacks=self.fallbacks, **self.flight.stats(), **self.pipeline.stats())
@@ -0,0 +1,125 @@
+import threading
+from collections import defaultdict
+
+
+class Subscription:
+    """Quotes waiting to be sent to one stream client.
+
+    Only quotes whose price or previous close differ from what the client
+    was last sent are queued. Updates that arrive while the client is still
+    writing the previous event are merged per ticker, so a slow client only
+    ever gets the latest price and never builds up a backlog.
+    """
+
+    def __init__(self, tickers):
+        self.tickers = frozenset(tickers)
+        self._sent = {}  # ticker -> (price, previous_close) last sent
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    @staticmethod
+    def _key(quote):
+        return quote.get('price'), quote.get('previous_close')
+
+    def mark_sent(self, quotes):
+        # Quotes the client was sent in full, e.g. its first snapshot
+        with self._lock:
+            for ticker, quote in quotes.items():
+                self._sent[ticker] = self._key(quote)
+                self._pending.pop(ticker, None)
+
+    def push(self, quotes):
+        # Returns how many tickers were queued as changed
+        changed = 0
+        with self._lock:
+            for ticker, quote in quotes.items():
+                if self._sent.get(ticker) == self._key(quote):
+                    # Unchanged, or moved back before the client was sent the move
+                    self._pending.pop(ticker, None)
+                else:
+                    self._pending[ticker] = quote
+                    changed += 1
+            if self._pending:
+                self._ready.set()
+        return changed
+
+    def wait(self, timeout):
+        # {ticker: quote} changed since the last call; empty on timeout
+        self._ready.wait(timeout)
+        with self._lock:
+            quotes, self._pending = self._pending, {}
+            self._ready.clear()
+            for ticker, quote in quotes.items():
+                self._sent[ticker] = self._key(quote)
+        return quotes
+
+
+class QuoteStream:
+    """Fans refreshed quotes out to live subscribers as deltas.
+
+    Registered as a quote listener, so every upstream fetch (request-driven
+    or from the background refresher) is handed to the subscribers watching
+    the fetched tickers, each of which queues only what moved since it was
+    last sent. At most `max_subscribers` streams may be open at once.
+    """
+
+    def __init__(self, max_subscribers=100):
+        self.max_subscribers = max_subscribers
+        self.updates = 0
+        self.deltas = 0
+        self.rejected = 0
+        self._subscribers = set()
+        self._by_ticker = defaultdict(set)  # ticker -> subscriptions
+        self._lock = threading.Lock()
+
+    def subscribe(self, tickers):
+        """Return a Subscription for `tickers`, or None if the stream is full."""
+        subscription = Subscription(tickers)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            self._subscribers.add(subscription)
+            for ticker in subscription.tickers:
+                self._by_ticker[ticker].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            for ticker in subscription.tickers:
+                subscribers = self._by_ticker.get(ticker)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_ticker[ticker]
+
+    def on_quotes(self, quotes):
+        # Quote listener: hand each subscriber the fetched quotes it watches
+        pushes = defaultdict(dict)
+        with self._lock:
+            self.updates += 1
+            for ticker, quote in quotes.items():
+                # Negative cache entries are not quotes
+                if isinstance(quote, dict):
+                    for subscription in self._by_ticker.get(ticker, ()):
+                        pushes[subscription][ticker] = quote
+        deltas = sum(subscription.push(fetched) for subscription, fetched in pushes.items())
+        with self._lock:
+            self.deltas += deltas
+
+    def tickers(self):
+        with self._lock:
+            return list(self._by_ticker)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'max_subscribers': self.max_subscribers,
+                'tickers': len(self._by_ticker),
+                'updates': self.updates,
+                'deltas': self.deltas,
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,38 @@
+"""Recompute the position ledger from transaction history and verify it.
+
+Usage: python rebuild_ledger.py [--uid UID] [--method average|fifo] [--verify-only]
+
+Without --verify-only the stored ledger is replaced by a replay of
+stock_transactions, adjusted to the quantities the portfolio holds; either
+way the result is checked against a fresh replay and against portfolio
+quantities.
+"""
+import argparse
+import sys
+
+import ledger
+from database import db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild and verify the position ledger')
+    parser.add_argument('--uid', type=int, help='only this user (default: everyone)')
+    parser.add_argument('--method', choices=['average', 'fifo'], default=ledger.COST_METHOD)
+    parser.add_argument('--verify-only', action='store_true', help='compare without rewriting')
+    args = parser.parse_args()
+
+    db.init_schema()
+    if not args.verify_only:
+        count = ledger.rebuild(args.uid, args.method)
+        print(f'rebuilt {count} positions')
+
+    mismatches = ledger.verify(args.uid, args.method)
+    if mismatches:
+        for mismatch in mismatches:
+            print(mismatch)
+        sys.exit(1)
+    print('ledger matches transaction history')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+from datetime import datetime, timezone
+
+import asset_series
+from database import db
+from user_cache import user_cache
+
+# Repository API over the SQLite tables. Every lookup below is served by an
+# index on (uid), (uid, ticker) or (uid, date); rows come back as dicts.
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+# Users
+
+def get_user_by_username(username):
+    return db.query_one('SELECT * FROM users WHERE username = ?', (username,))
+
+
+def get_user(uid):
+    return db.query_one('SELECT * FROM users WHERE id = ?', (uid,))
+
+
+def list_users():
+    return db.query('SELECT * FROM users ORDER BY id')
+
+
+def create_user(username, password, balance=0, created_at=None):
+    cursor = db.execute(
+        'INSERT INTO users (username, password, balance, created_at) VALUES (?, ?, ?, ?)',
+        (username, password, balance, created_at or now_iso()),
+    )
+    db.after_commit(lambda: user_cache.invalidate(username=username))
+    return cursor.lastrowid
+
+
+def get_users_after(after_uid, limit, without_snapshot_on=None):
+    # Batch of users ordered by id; optionally only those with no asset
+    # history row for the given date yet
+    if without_snapshot_on is None:
+        return db.query(
+            'SELECT id, balance FROM users WHERE id > ? ORDER BY id LIMIT ?', (after_uid, limit)
+        )
+    return db.query(
+        'SELECT id, balance FROM users u WHERE id > ? AND NOT EXISTS '
+        '(SELECT 1 FROM history_asset h WHERE h.uid = u.id AND h.date = ?) ORDER BY id LIMIT ?',
+        (after_uid, without_snapshot_on, limit),
+    )
+
+
+def update_balance(uid, balance):
+    db.execute(
+        'UPDATE users SET balance = ?, updated_at = ? WHERE id = ?',
+        (balance, now_iso(), uid),
+    )
+    db.after_commit(lambda: user_cache.invalidate(uid))
+
+
+# Watchlists
+
+def get_watchlist(uid):
+    rows = db.execute('SELECT ticker FROM watchlist WHERE uid = ? ORDER BY position', (uid,))
+    return [row['ticker'] for row in rows]
+
+
+def get_watchlists(uids):
+    # {uid: [tickers in watchlist order]} for many users in one query
+    watchlists = {uid: [] for uid in uids}
+    if not uids:
+        return watchlists
+    placeholders = ', '.join('?' * len(uids))
+    rows = db.execute(
+        f'SELECT uid, ticker FROM watchlist WHERE uid IN ({placeholders}) ORDER BY uid, position',
+        tuple(uids),
+    )
+    for row in rows:
+        watchlists[row['uid']].append(row['ticker'])
+    return watchlists
+
+
+def add_to_watchlist(uid, ticker):
+    with db.transaction():
+        db.execute(
+            'INSERT OR IGNORE INTO watchlist (uid, ticker, position) '
+            'SELECT ?, ?, COALESCE(MAX(position) + 1, 0) FROM watchlist WHERE uid = ?',
+            (uid, ticker, uid),
+        )
+
+
+def remove_from_watchlist(uid, ticker):
+    db.execute('DELETE FROM watchlist WHERE uid = ? AND ticker = ?', (uid, ticker))
+
+
+def get_watched_tickers():
+    return [row['ticker'] for row in db.execute('SELECT DISTINCT ticker FROM watchlist')]
+
+
+# Portfolio positions
+
+def get_positions(uid):
+    return db.query('SELECT * FROM portfolio WHERE uid = ? ORDER BY id', (uid,))
+
+
+def count_positions(uid):
+    return db.execute('SELECT COUNT(*) FROM portfolio WHERE uid = ?', (uid,)).fetchone()[0]
+
+
+def get_positions_page(uid, offset, limit):
+    return db.query(
+        'SELECT * FROM portfolio WHERE uid = ? ORDER BY id LIMIT ? OFFSET ?',
+        (uid, limit, offset),
+    )
+
+
+def get_positions_after(uid, after_id, limit):
+    # Keyset page: positions with an id greater than the last one seen
+    if after_id is None:
+        return db.query('SELECT * FROM portfolio WHERE uid = ? ORDER BY id LIMIT ?', (uid, limit))
+    return db.query(
+        'SELECT * FROM portfolio WHERE uid = ? AND id > ? ORDER BY id LIMIT ?',
+        (uid, after_id, limit),
+    )
+
+
+def get_positions_for_users(uids):
+    if not uids:
+        return []
+    placeholders = ', '.join('?' * len(uids))
+    return db.query(f'SELECT * FROM portfolio WHERE uid IN ({placeholders})', tuple(uids))
+
+
+def get_position(uid, ticker):
+    return db.query_one('SELECT * FROM portfolio WHERE uid = ? AND ticker = ?', (uid, ticker))
+
+
+def set_position_quantity(uid, ticker, quantity):
+    # A position that drops to zero shares is removed
+    if quantity == 0:
+        db.execute('DELETE FROM portfolio WHERE uid = ? AND ticker = ?', (uid, ticker))
+        return
+    now = now_iso()
+    db.execute(
+        'INSERT INTO portfolio (uid, ticker, total_quantity, created_at) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT (uid, ticker) DO UPDATE SET total_quantity = excluded.total_quantity, updated_at = ?',
+        (uid, ticker, quantity, now, now),
+    )
+
+
+def get_held_tickers():
+    return [row['ticker'] for row in db.execute('SELECT DISTINCT ticker FROM portfolio')]
+
+
+# Stock transactions
+
+def add_transaction(uid, ticker, action, quantity, price, created_at=None):
+    cursor = db.execute(
+        'INSERT INTO stock_transactions (uid, ticker, action, quantity, price, created_at) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (uid, ticker, action, quantity, price, created_at or now_iso()),
+    )
+    return cursor.lastrowid
+
+
+def count_transactions(uid):
+    # Maintained by triggers on stock_transactions
+    row = db.query_one('SELECT count FROM transaction_counts WHERE uid = ?', (uid,))
+    return row['count'] if row else 0
+
+
+def get_transactions_page(uid, offset, limit):
+    return db.query(
+        'SELECT * FROM stock_transactions WHERE uid = ? ORDER BY created_at, id LIMIT ? OFFSET ?',
+        (uid, limit, offset),
+    )
+
+
+def get_transactions_after(uid, after, limit):
+    # Keyset page ordered by (created_at, id), seeking past the last row seen
+    if after is None:
+        return db.query(
+            'SELECT * FROM stock_transactions WHERE uid = ? ORDER BY created_at, id LIMIT ?',
+            (uid, limit),
+        )
+    created_at, transaction_id = after
+    return db.query(
+        'SELECT * FROM stock_transactions WHERE uid = ? AND (created_at, id) > (?, ?) '
+        'ORDER BY created_at, id LIMIT ?',
+        (uid, created_at, transaction_id, limit),
+    )
+
+
+def iter_transactions(uid, start=None, end=None, ticker=None, batch_size=1000):
+    """Yield a user's transactions ordered by (created_at, id), optionally
+    only for `ticker` and for created_at in [start, end).
+
+    Rows are read in keyset batches of `batch_size`, so memory stays flat
+    and no read transaction is held open while the caller consumes rows.
+    Filtered exports are served by the (uid, ticker, created_at, id) index.
+    """
+    where = ['uid = ?']
+    params = [uid]
+    if ticker:
+        where.append('ticker = ?')
+        params.append(ticker)
+    if start:
+        where.append('created_at >= ?')
+        params.append(start)
+    if end:
+        where.append('created_at < ?')
+        params.append(end)
+    sql = f'SELECT * FROM stock_transactions WHERE {" AND ".join(where)}'
+    after = None
+    while True:
+        if after is None:
+            rows = db.query(f'{sql} ORDER BY created_at, id LIMIT ?', (*params, batch_size))
+        else:
+            rows = db.query(f'{sql} AND (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?',
+                            (*params, *after, batch_size))
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1]['created_at'], rows[-1]['id'])
+
+
+# Daily asset history
+
+def get_asset_history(uid):
+    return db.query('SELECT * FROM history_asset WHERE uid = ? ORDER BY date', (uid,))
+
+
+def upsert_asset_history_many(rows):
+    # rows: iterable of (uid, date, total_value); the columnar series used
+    # by charts is updated in the same transaction
+    rows = list(rows)
+    with db.transaction():
+        db.executemany(
+            'INSERT INTO history_asset (uid, total_value, date) VALUES (?, ?, ?) '
+            'ON CONFLICT (uid, date) DO UPDATE SET total_value = excluded.total_value',
+            [(uid, total_value, date) for uid, date, total_value in rows],
+        )
+        asset_series.record(rows)
+
+
+def upsert_asset_history(uid, date, total_value):
+    upsert_asset_history_many([(uid, date, total_value)])
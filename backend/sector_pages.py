@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from singleflight import SingleFlight
+
+log = logging.getLogger('stocks.sector_pages')
+
+
+class SectorPages:
+    """Precomputed /listBySector responses keyed by (sector, page, per_page).
+
+    `build(sector, page, per_page)` returns (payload, tickers); the payload is
+    serialized once with `dumps` and stored with its ETag, so a request is a
+    dictionary lookup. Pages are rebuilt in the background when quotes for
+    any of their tickers are refreshed, and on request once older than
+    `max_age` seconds. At most `max_pages` pages are kept (LRU).
+    """
+
+    def __init__(self, build, dumps, max_age=15, max_pages=1000, clock=time.monotonic):
+        self.build = build
+        self.dumps = dumps
+        self.max_age = max_age
+        self.max_pages = max_pages
+        self.clock = clock
+        self.builds = 0
+        self.rebuilds = 0
+        self._pages = OrderedDict()  # key -> {'body', 'etag', 'tickers', 'built_at'}
+        self._by_ticker = defaultdict(set)  # ticker -> keys of pages showing it
+        self._lock = threading.Lock()
+        self.flight = SingleFlight()
+        self._rebuilder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sector-pages')
+        self._pending = set()
+
+    def get(self, sector, page, per_page):
+        """Return the stored page {'body', 'etag', ...}, building it if needed."""
+        key = (sector, page, per_page)
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is not None and self.clock() - entry['built_at'] < self.max_age:
+                self._pages.move_to_end(key)
+                return entry
+        return self.flight.do(key, lambda: self._build(key))
+
+    def _build(self, key):
+        payload, tickers = self.build(*key)
+        body = self.dumps(payload)
+        entry = {
+            'body': body,
+            'etag': hashlib.sha1(body.encode('utf-8')).hexdigest(),
+            'tickers': tuple(tickers),
+            'built_at': self.clock(),
+        }
+        with self._lock:
+            self._forget(key)
+            self._pages[key] = entry
+            for ticker in entry['tickers']:
+                self._by_ticker[ticker].add(key)
+            while len(self._pages) > self.max_pages:
+                self._forget(next(iter(self._pages)))
+            self.builds += 1
+        return entry
+
+    def _forget(self, key):
+        # Caller holds self._lock
+        entry = self._pages.pop(key, None)
+        if entry is None:
+            return
+        for ticker in entry['tickers']:
+            keys = self._by_ticker.get(ticker)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_ticker[ticker]
+
+    def on_quotes(self, quotes):
+        # Quote listener: queue a rebuild of every page showing a refreshed ticker
+        with self._lock:
+            keys = set()
+            for ticker in quotes:
+                keys.update(self._by_ticker.get(ticker, ()))
+            keys -= self._pending
+            self._pending.update(keys)
+        if keys:
+            self._rebuilder.submit(self._rebuild, keys)
+
+    def _rebuild(self, keys):
+        for key in keys:
+            with self._lock:
+                self._pending.discard(key)
+                if key not in self._pages:
+                    continue
+            try:
+                self.flight.do(key, lambda: self._build(key))
+                self.rebuilds += 1
+            except Exception:
+                # The page is rebuilt on request once it is older than max_age
+                log.exception("background rebuild of sector page %s failed", key)
+
+    def tickers(self):
+        # Tickers shown on any stored page, so the price refresher keeps them warm
+        with self._lock:
+            return list(self._by_ticker)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._by_ticker.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pages': len(self._pages),
+                'builds': self.builds,
+                'rebuilds': self.rebuilds,
+                'max_pages': self.max_pages,
+            }
@@ -0,0 +1,82 @@
+import threading
+
+
+class _Call:
+    # One in-flight fetch that any number of threads can wait on
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent fetches of the same key into one call.
+
+    The first thread to ask for a key becomes its leader and performs the
+    fetch; threads arriving while it is in flight wait for and share the
+    leader's result instead of going upstream themselves.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self.fetched = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fetch):
+        # Single-key form: fetch() returns the value for key
+        return self.do_many([key], lambda keys: {key: fetch()}).get(key)
+
+    def do_many(self, keys, fetch):
+        """Resolve keys, calling fetch(list_of_keys) -> {key: value} once for
+        every key nobody else is already fetching.
+
+        Keys missing from fetch's result are left out of the returned dict.
+        If the leader's fetch raises, every waiter on its keys raises too.
+        """
+        owned = {}
+        waiting = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    owned[key] = call
+                else:
+                    waiting[key] = call
+                    self.coalesced += 1
+            self.fetched += len(owned)
+
+        results = {}
+        if owned:
+            fetched, error = {}, None
+            try:
+                fetched = fetch(list(owned))
+            except Exception as exc:
+                error = exc
+            with self._lock:
+                for key in owned:
+                    del self._calls[key]
+            for key, call in owned.items():
+                call.result = fetched.get(key)
+                call.error = error
+                call.done.set()
+            if error is not None:
+                raise error
+            results.update((key, value) for key, value in fetched.items() if key in owned)
+
+        for key, call in waiting.items():
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            if call.result is not None:
+                results[key] = call.result
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                'coalesced': self.coalesced,
+                'fetched': self.fetched,
+                'in_flight': len(self._calls),
+            }
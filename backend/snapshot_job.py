@@ -0,0 +1,126 @@
+"""Daily asset-history snapshot for every user.
+
+Usage: python snapshot_job.py [--date YYYY-MM-DD] [--chunk-size 1000] [--force]
+
+Values every portfolio from one bulk quote fetch and upserts one
+history_asset row per user for the date. Users that already have a row
+for the date are skipped, so an interrupted run resumes where it stopped
+and re-running is harmless; --force revalues everyone. Users holding a
+ticker without a quote get no row (it would understate their total) and
+are listed in the report, so a later run can fill them in.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import repository
+import valuation
+from database import db
+
+log = logging.getLogger('stocks.snapshot')
+
+
+def run_snapshot(market_data, snapshot_date=None, chunk_size=1000, force=False):
+    snapshot_date = snapshot_date or date.today().isoformat()
+    started = time.perf_counter()
+
+    # One bulk price fetch covers every held ticker
+    quotes = market_data.get_quotes(repository.get_held_tickers())
+
+    users = 0
+    unpriced_uids = []
+    after_uid = 0
+    while True:
+        batch = repository.get_users_after(after_uid, chunk_size, None if force else snapshot_date)
+        if not batch:
+            break
+        uids = [user['id'] for user in batch]
+        totals = valuation.value_all_users(
+            repository.get_positions_for_users(uids),
+            quotes,
+            {user['id']: user['balance'] for user in batch},
+        )
+        priced = totals[totals['unpriced'] == 0]
+        unpriced_uids.extend(int(uid) for uid in totals.index[totals['unpriced'] > 0])
+        # Each chunk is committed on its own, so progress survives a crash
+        with db.transaction():
+            repository.upsert_asset_history_many(
+                (int(uid), snapshot_date, round(float(total), 2))
+                for uid, total in priced['total_value'].items()
+            )
+        users += len(priced)
+        after_uid = uids[-1]
+
+    seconds = time.perf_counter() - started
+    return {
+        'date': snapshot_date,
+        'users': users,
+        'tickers': len(quotes),
+        'skipped_unpriced': len(unpriced_uids),
+        'unpriced_uids': unpriced_uids[:100],
+        'seconds': round(seconds, 3),
+        'seconds_per_1000_users': round(seconds / users * 1000, 3) if users else 0.0,
+    }
+
+
+class SnapshotScheduler:
+    """Runs the snapshot once a day at a local HH:MM time in a daemon thread."""
+
+    def __init__(self, market_data, at):
+        self.market_data = market_data
+        self.hour, self.minute = (int(part) for part in at.split(':'))
+        self.last_report = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def seconds_until_next_run(self, now=None):
+        now = now or datetime.now()
+        next_run = now.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    def _run(self):
+        while True:
+            time.sleep(self.seconds_until_next_run())
+            try:
+                self.last_report = run_snapshot(self.market_data)
+                log.info(json.dumps(dict(self.last_report, event='asset_snapshot')))
+            except Exception:
+                log.exception("asset snapshot failed")
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='asset-snapshot', daemon=True)
+                self._thread.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot every user\'s total asset value for a day')
+    parser.add_argument('--date', help='snapshot date (default: today)')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--force', action='store_true', help='revalue users that already have a row')
+    args = parser.parse_args()
+
+    from market_data import create_provider
+    db.init_schema()
+    report = run_snapshot(
+        create_provider(os.environ.get('MARKET_DATA_PROVIDER', 'yfinance')),
+        args.date,
+        args.chunk_size,
+        args.force,
+    )
+    print(f"{report['date']}: {report['users']} users, {report['tickers']} tickers in "
+          f"{report['seconds']}s ({report['seconds_per_1000_users']}s per 1000 users)")
+    if report['skipped_unpriced']:
+        print(f"skipped {report['skipped_unpriced']} users holding tickers without a quote, "
+              f"e.g. uids {report['unpriced_uids'][:10]}")
+
+
+if __name__ == '__main__':
+    main()
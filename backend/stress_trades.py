@@ -0,0 +1,121 @@
+"""Concurrency stress test for the trade endpoints.
+
+Fires thousands of parallel /buy and /sell requests at a few accounts,
+using the offline fake market data provider and a throwaway database,
+then checks that every account's balance and holdings match the trades
+that were accepted.
+
+Usage: python stress_trades.py [--orders 5000] [--threads 32] [--users 4]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress test concurrent buys and sells')
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--balance', type=float, default=50000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='stress-trades-')
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'stress.db')
+    os.environ['MARKET_DATA_PROVIDER'] = 'fake'
+    os.environ['PRICE_REFRESH_INTERVAL'] = '0'
+    os.chdir(workdir)  # keep the app from importing a local stocks.json
+
+    from flask_jwt_extended import create_access_token
+    from app import app, market_data
+    import repository
+    from trade_engine import writer
+
+    tickers = ['AAPL', 'MSFT', 'NVDA', 'ORCL', 'CRM']
+    prices = {ticker: quote['price'] for ticker, quote in market_data.get_quotes(tickers).items()}
+
+    uids = []
+    tokens = {}
+    with app.app_context():
+        for i in range(args.users):
+            username = f'stress{i}@test.com'
+            uid = repository.create_user(username, 'not-a-hash', balance=args.balance)
+            uids.append(uid)
+            tokens[uid] = create_access_token(identity=username)
+
+    accepted = defaultdict(list)  # uid -> [(action, ticker, quantity)]
+    accepted_lock = threading.Lock()
+    errors = []
+    per_thread = args.orders // args.threads
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        for _ in range(per_thread):
+            uid = rng.choice(uids)
+            ticker = rng.choice(tickers)
+            action = rng.choice(['BUY', 'SELL'])
+            quantity = rng.randint(1, 5)
+            response = client.post(
+                '/buy' if action == 'BUY' else '/sell',
+                json={'ticker': ticker, 'quantity': quantity},
+                headers={'Authorization': f'Bearer {tokens[uid]}'},
+            )
+            if response.status_code == 200:
+                with accepted_lock:
+                    accepted[uid].append((action, ticker, quantity))
+            elif response.status_code != 400:
+                errors.append(response.get_data(as_text=True))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(args.seed + i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    failures = list(errors)
+    for uid in uids:
+        balance = args.balance
+        holdings = defaultdict(int)
+        for action, ticker, quantity in accepted[uid]:
+            sign = 1 if action == 'BUY' else -1
+            balance -= sign * prices[ticker] * quantity
+            holdings[ticker] += sign * quantity
+
+        user = repository.get_user(uid)
+        if abs(user['balance'] - balance) > 1e-6 or user['balance'] < 0:
+            failures.append(f'user {uid}: balance {user["balance"]} != expected {balance}')
+        for ticker in tickers:
+            position = repository.get_position(uid, ticker)
+            quantity = position['total_quantity'] if position else 0
+            if quantity != holdings[ticker] or quantity < 0:
+                failures.append(f'user {uid} {ticker}: holding {quantity} != expected {holdings[ticker]}')
+        if repository.count_transactions(uid) != len(accepted[uid]):
+            failures.append(f'user {uid}: transaction count does not match accepted trades')
+
+    total = per_thread * args.threads
+    filled = sum(len(trades) for trades in accepted.values())
+    print(f'{total} orders ({filled} filled) on {args.threads} threads in {elapsed:.2f}s '
+          f'({total / elapsed:.0f} orders/s)')
+    if writer is not None:
+        stats = writer.stats()
+        print(f"group commit: {stats['writes']} writes in {stats['batches']} commits "
+              f"(avg {stats['avg_batch_size']:.1f} per commit)")
+    if failures:
+        print('FAILED')
+        for failure in failures[:20]:
+            print(' ', failure)
+        sys.exit(1)
+    print('OK: balances and holdings are consistent')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import logging
+import math
+import os
+import threading
+import time
+
+import ledger
+import repository
+from database import db
+from group_commit import GroupCommitWriter
+from metrics import metrics
+
+
+class TradeError(Exception):
+    """A trade or cash movement that was rejected; nothing was written."""
+
+
+class OrdersRejected(TradeError):
+    """A batch of orders failed validation; `results` has one entry per
+    order, with an `error` on each order that was rejected."""
+
+    def __init__(self, message, results):
+        super().__init__(message)
+        self.results = results
+
+
+log = logging.getLogger('stocks.trades')
+
+_user_locks = {}
+_user_locks_lock = threading.Lock()
+
+# Trades, deposits and withdrawals from all request threads are committed
+# in groups by one writer thread; GROUP_COMMIT=0 commits each in its caller
+writer = GroupCommitWriter(
+    db,
+    max_batch=int(os.environ.get('GROUP_COMMIT_MAX_BATCH', 512)),
+    checkpoint_interval=int(os.environ.get('WAL_CHECKPOINT_INTERVAL', 30)),
+) if os.environ.get('GROUP_COMMIT', '1') != '0' else None
+
+
+def user_lock(uid):
+    # One lock per user so trades from the same account run one at a time
+    with _user_locks_lock:
+        lock = _user_locks.get(uid)
+        if lock is None:
+            lock = _user_locks[uid] = threading.Lock()
+        return lock
+
+
+def _write(uid, operation):
+    if writer is not None:
+        # The single writer thread already applies writes one at a time;
+        # the wait counts as this request's database time
+        started = time.perf_counter()
+        try:
+            return writer.submit(operation)
+        finally:
+            metrics.add_request('db', time.perf_counter() - started)
+    with user_lock(uid), db.transaction():
+        return operation()
+
+
+def _record_ledger(uid, trades):
+    # trades: (ticker, action, quantity, price, transaction_id, created_at),
+    # already written to stock_transactions and the portfolio. A ledger that
+    # disagrees with the portfolio is rebuilt for this user (the rebuild
+    # includes these trades) instead of failing the trade
+    try:
+        with db.transaction():
+            for trade in trades:
+                ledger.record_trade(uid, *trade)
+    except ledger.LedgerError as e:
+        log.warning("ledger for uid %s is out of sync (%s); rebuilding it", uid, e)
+        try:
+            ledger.rebuild(uid)
+        except ledger.LedgerError as e:
+            raise TradeError("Position history is inconsistent; the trade was not recorded") from e
+
+
+def _check_quantity(quantity):
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+        raise TradeError("Quantity must be a positive whole number")
+
+
+def _check_amount(amount):
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) \
+            or not math.isfinite(amount) or amount <= 0:
+        raise TradeError("Amount must be a positive number")
+
+
+def execute_trade(uid, ticker, action, quantity, price):
+    """Buy or sell `quantity` shares of `ticker` at `price` for user `uid`.
+
+    Balance and holdings are read, checked and written inside one database
+    transaction, so the trade is committed as a single durable write or not
+    at all. Returns the new balance and position quantity.
+    """
+    _check_quantity(quantity)
+    amount = price * quantity
+
+    def apply():
+        user = repository.get_user(uid)
+        position = repository.get_position(uid, ticker)
+        held = position['total_quantity'] if position else 0
+
+        if action == 'BUY':
+            if user['balance'] < amount:
+                raise TradeError("Not enough balance")
+            balance = user['balance'] - amount
+            held += quantity
+        elif action == 'SELL':
+            if held < quantity:
+                raise TradeError("Not enough stock to sell")
+            balance = user['balance'] + amount
+            held -= quantity
+        else:
+            raise TradeError(f"Unknown action: {action}")
+
+        created_at = repository.now_iso()
+        transaction_id = repository.add_transaction(uid, ticker, action, quantity, price, created_at)
+        repository.update_balance(uid, balance)
+        repository.set_position_quantity(uid, ticker, held)
+        _record_ledger(uid, [(ticker, action, quantity, price, transaction_id, created_at)])
+        return {'transaction_id': transaction_id, 'balance': balance, 'quantity': held}
+
+    return _write(uid, apply)
+
+
+def execute_orders(uid, orders, prices):
+    """Apply a basket of orders for user `uid` as one atomic write.
+
+    `orders` is a list of (ticker, action, quantity) and `prices` maps each
+    ticker to its price; a ticker without a price (unknown, or no current
+    quote) is rejected.
+    Sells are applied before buys so their proceeds can fund the buys, and
+    every order is checked against the balance and holdings left by the
+    orders before it. If any order is rejected, OrdersRejected is raised and
+    nothing is written. Returns per-order results in request order plus the
+    new balance.
+    """
+    results = []
+    for ticker, action, quantity in orders:
+        result = {'ticker': ticker, 'action': action, 'quantity': quantity, 'price': prices.get(ticker)}
+        try:
+            _check_quantity(quantity)
+            if action not in ('BUY', 'SELL'):
+                raise TradeError(f"Unknown action: {action}")
+            if result['price'] is None:
+                raise TradeError("Unknown stock or no current price")
+        except TradeError as e:
+            result['error'] = str(e)
+        results.append(result)
+    if any('error' in result for result in results):
+        raise OrdersRejected("One or more orders were rejected", results)
+
+    def apply():
+        balance = repository.get_user(uid)['balance']
+        held = {}
+        # Stable sort: sells first, otherwise request order
+        ordered = sorted(results, key=lambda result: result['action'] != 'SELL')
+        for result in ordered:
+            ticker, quantity = result['ticker'], result['quantity']
+            if ticker not in held:
+                position = repository.get_position(uid, ticker)
+                held[ticker] = position['total_quantity'] if position else 0
+            amount = result['price'] * quantity
+            if result['action'] == 'BUY':
+                if balance < amount:
+                    result['error'] = "Not enough balance"
+                    continue
+                balance -= amount
+                held[ticker] += quantity
+            else:
+                if held[ticker] < quantity:
+                    result['error'] = "Not enough stock to sell"
+                    continue
+                balance += amount
+                held[ticker] -= quantity
+        if any('error' in result for result in results):
+            raise OrdersRejected("One or more orders were rejected", results)
+
+        created_at = repository.now_iso()
+        trades = []
+        for result in ordered:
+            ticker, action, quantity, price = result['ticker'], result['action'], result['quantity'], result['price']
+            result['transaction_id'] = repository.add_transaction(uid, ticker, action, quantity, price, created_at)
+            trades.append((ticker, action, quantity, price, result['transaction_id'], created_at))
+        repository.update_balance(uid, balance)
+        for ticker, quantity in held.items():
+            repository.set_position_quantity(uid, ticker, quantity)
+        _record_ledger(uid, trades)
+        return {'results': results, 'balance': balance}
+
+    return _write(uid, apply)
+
+
+def deposit(uid, amount):
+    _check_amount(amount)
+
+    def apply():
+        balance = repository.get_user(uid)['balance'] + amount
+        repository.update_balance(uid, balance)
+        return balance
+
+    return _write(uid, apply)
+
+
+def withdraw(uid, amount):
+    _check_amount(amount)
+
+    def apply():
+        balance = repository.get_user(uid)['balance']
+        if balance < amount:
+            raise TradeError("Not enough balance")
+        balance -= amount
+        repository.update_balance(uid, balance)
+        return balance
+
+    return _write(uid, apply)
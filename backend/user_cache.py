@@ -0,0 +1,92 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class UserCache:
+    """Size-bounded LRU cache of user rows, indexed by id and username.
+
+    Every users-table write invalidates the affected row once its
+    transaction commits (see repository). A lookup that raced with a write
+    is not cached: `generation()` is read before going to the database and
+    put() drops the row if anything was invalidated since.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._by_id = OrderedDict()  # id -> user row
+        self._ids = {}  # username -> id
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def get_by_id(self, uid):
+        with self._lock:
+            user = self._by_id.get(uid)
+            if user is None:
+                self.misses += 1
+                return None
+            self._by_id.move_to_end(uid)
+            self.hits += 1
+            return dict(user)
+
+    def get_by_username(self, username):
+        with self._lock:
+            uid = self._ids.get(username)
+        if uid is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        return self.get_by_id(uid)
+
+    def put(self, user, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._drop(user['id'])
+            self._by_id[user['id']] = dict(user)
+            self._ids[user['username']] = user['id']
+            while len(self._by_id) > self.max_entries:
+                self._drop(next(iter(self._by_id)))
+
+    def _drop(self, uid):
+        # Caller holds self._lock
+        user = self._by_id.pop(uid, None)
+        if user is not None and self._ids.get(user['username']) == uid:
+            del self._ids[user['username']]
+
+    def invalidate(self, uid=None, username=None):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if uid is None and username is not None:
+                uid = self._ids.get(username)
+            if uid is not None:
+                self._drop(uid)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._by_id.clear()
+            self._ids.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._by_id),
+                'max_entries': self.max_entries,
+            }
+
+
+user_cache = UserCache(int(os.environ.get('USER_CACHE_SIZE', 10000)))
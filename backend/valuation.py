@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# Portfolio valuation with pandas/NumPy: positions are joined against a
+# price vector and every derived column is computed in one vectorized pass.
+
+POSITION_COLUMNS = ['uid', 'ticker', 'quantity']
+
+
+def price_vector(quotes):
+    # {ticker: quote} -> DataFrame indexed by ticker with price and previous_close
+    frame = pd.DataFrame.from_records(
+        [(ticker, quote['price'], quote.get('previous_close')) for ticker, quote in quotes.items()],
+        columns=['ticker', 'price', 'previous_close'],
+    )
+    return frame.set_index('ticker').astype(float)
+
+
+def positions_frame(positions):
+    # Portfolio rows ({'uid', 'ticker', 'total_quantity', ...}) -> DataFrame
+    frame = pd.DataFrame.from_records(
+        [(p.get('uid'), p['ticker'], p['total_quantity']) for p in positions],
+        columns=POSITION_COLUMNS,
+    )
+    frame['quantity'] = frame['quantity'].astype(float)
+    return frame
+
+
+def value_positions(positions, quotes, balance=0.0):
+    """Value one portfolio. Returns one row per priced position with
+    price, market_value, day_change (per share), day_change_percent,
+    day_change_value and weight (share of holdings plus cash).
+
+    Positions without a quote are dropped.
+    """
+    frame = positions_frame(positions).join(price_vector(quotes), on='ticker', how='inner')
+    frame['market_value'] = frame['quantity'] * frame['price']
+    frame['day_change'] = frame['price'] - frame['previous_close']
+    frame['day_change_percent'] = frame['day_change'] / frame['previous_close'] * 100
+    frame['day_change_value'] = frame['day_change'] * frame['quantity']
+    total = frame['market_value'].sum() + balance
+    frame['weight'] = frame['market_value'] / total if total else 0.0
+    return frame.reset_index(drop=True)
+
+
+def total_value(positions, quotes, balance=0.0):
+    return float(value_positions(positions, quotes).market_value.sum() + balance)
+
+
+def value_all_users(positions, quotes, balances):
+    """Value every user's portfolio at once for batch jobs.
+
+    `positions` are portfolio rows for any number of users and `balances`
+    maps uid -> cash balance. Returns a DataFrame indexed by uid with
+    holdings_value, day_change_value, balance, total_value and unpriced, the
+    number of held positions without a quote (valued at 0, so total_value
+    understates those users).
+    """
+    frame = positions_frame(positions).join(price_vector(quotes), on='ticker', how='left')
+    frame['market_value'] = (frame['quantity'] * frame['price']).fillna(0.0)
+    frame['day_change_value'] = ((frame['price'] - frame['previous_close']) * frame['quantity']).fillna(0.0)
+    frame['unpriced'] = (frame['price'].isna() & (frame['quantity'] > 0)).astype(int)
+    totals = frame.groupby('uid')[['market_value', 'day_change_value', 'unpriced']].sum()
+
+    cash = pd.Series(balances, dtype=float, name='balance')
+    cash.index.name = 'uid'
+    result = totals.reindex(cash.index.union(totals.index), fill_value=0.0)
+    result['unpriced'] = result['unpriced'].astype(int)
+    result['balance'] = cash.reindex(result.index).fillna(0.0)
+    result = result.rename(columns={'market_value': 'holdings_value'})
+    result['total_value'] = result['holdings_value'].to_numpy() + result['balance'].to_numpy()
+    return result
+
+
+def na(value, digits=None):
+    # JSON-friendly scalar: NaN becomes 'N/A', optionally rounded
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return 'N/A'
+    return round(float(value), digits) if digits is not None else float(value)